@@ -1,11 +1,12 @@
 from pathlib import Path
 from decouple import config
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = config('SECRET_KEY')
-DEBUG = config("DEBUG")
+DEBUG = config("DEBUG", default=False, cast=bool)
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='')
 ALLOWED_HOSTS = [h.strip() for h in ALLOWED_HOSTS.split(',') if h.strip()]
 
@@ -27,6 +28,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shop.query_budget.QueryBudgetMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,11 +59,17 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'coorgspices.wsgi.application'
 
+# Without DATABASE_URL (development) a local SQLite file is used
+DATABASE_URL = config("DATABASE_URL", default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
 DATABASES = {
-    "default": dj_database_url.config(
-        default=config("DATABASE_URL"), conn_max_age=600, ssl_require=True
+    "default": dj_database_url.parse(
+        DATABASE_URL, conn_max_age=600, ssl_require=not DATABASE_URL.startswith("sqlite")
     )
 }
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # A file rather than SQLite's in-memory test database, which only one
+    # connection can use: the concurrency tests need several
+    DATABASES["default"]["TEST"] = {"NAME": str(BASE_DIR / "test_db.sqlite3")}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -87,13 +95,53 @@ AUTHENTICATION_BACKENDS = [
     'allauth.account.auth_backends.AuthenticationBackend',
 ]
 
+# ------------------ Cache ------------------
+# Catalog pages are cached per catalog version (see shop/catalog_cache.py).
+# The version itself is kept in the database, so a per-process cache stays
+# correct with any number of gunicorn workers and job processes. The cart
+# badge count is only cached in a cache every process shares, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="coorgspices"),
+    }
+}
+
+# ------------------ Query budgets ------------------
+# shop/query_budget.py counts the SQL of a sample of requests and logs any
+# that exceed their per-URL budget or repeat a query in a loop. The test
+# runner turns on strict mode, where such a request raises instead.
+QUERY_BUDGET_SAMPLE_RATE = config("QUERY_BUDGET_SAMPLE_RATE", default=0.01, cast=float)
+QUERY_BUDGET_STRICT = config("QUERY_BUDGET_STRICT", default=False, cast=bool)
+TEST_RUNNER = "coorgspices.test_runner.StrictQueryBudgetRunner"
+
+# ------------------ Stock reservations ------------------
+# Seconds the checkout page holds the stock of the cart (shop/reservations.py).
+# Run `manage.py expire_reservations` every minute to release expired holds.
+STOCK_RESERVATION_TTL = config("STOCK_RESERVATION_TTL", default=15 * 60, cast=int)
+
 LOGIN_REDIRECT_URL = '/'
 ACCOUNT_LOGOUT_REDIRECT_URL = '/'
 
-# ------------------ AWS S3 Storage ------------------
+# ------------------ Media storage ------------------
+# MEDIA_STORAGE picks where uploads live:
+#   s3     - the S3 bucket below (production; needs the AWS_* variables)
+#   local  - MEDIA_ROOT on disk, served by runserver when DEBUG is on
+#   memory - in-process only, for tests and benchmarks
+# It defaults to s3 when AWS_STORAGE_BUCKET_NAME is set and local otherwise.
+AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME", default="")
+MEDIA_STORAGE = config("MEDIA_STORAGE", default="s3" if AWS_STORAGE_BUCKET_NAME else "local")
+
+MEDIA_STORAGE_BACKENDS = {
+    "s3": "coorgspices.storages.MediaStorage",
+    "local": "django.core.files.storage.FileSystemStorage",
+    "memory": "django.core.files.storage.InMemoryStorage",
+}
+
 STORAGES = {
     "default": {
-        "BACKEND": "coorgspices.storages.MediaStorage",
+        "BACKEND": MEDIA_STORAGE_BACKENDS[MEDIA_STORAGE],
     },
 
     "staticfiles": {
@@ -101,24 +149,36 @@ STORAGES = {
     },
 }
 
-AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY")
-AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME")
-AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", default="ap-south-1")
-AWS_S3_SIGNATURE_VERSION = "s3v4"
+if MEDIA_STORAGE == "s3":
+    AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID")
+    AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY")
+    AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", default="ap-south-1")
+    AWS_S3_SIGNATURE_VERSION = "s3v4"
 
-AWS_DEFAULT_ACL = None
-AWS_QUERYSTRING_AUTH = False
-AWS_S3_FILE_OVERWRITE = False
+    AWS_DEFAULT_ACL = None
+    AWS_QUERYSTRING_AUTH = False
 
-AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
-MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/media/"
+    AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
+    MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/media/"
+else:
+    MEDIA_ROOT = config("MEDIA_ROOT", default=str(BASE_DIR / "media"))
+    MEDIA_URL = "/media/"
 
 # ------------------ EMAIL SETTINGS (Gmail SMTP) ------------------
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = config('EMAIL_HOST')
-EMAIL_PORT = config('EMAIL_PORT', cast=int)
-EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool)
-EMAIL_HOST_USER = config('EMAIL_HOST_USER')
-EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
-DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
+# Mail is sent by `manage.py run_jobs` (shop/jobs.py), never inside a request
+# Without EMAIL_HOST mail is printed to the console instead, but only with
+# DEBUG on: a production process missing it must not drop mail silently
+EMAIL_HOST = config('EMAIL_HOST', default='')
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='')
+if not EMAIL_BACKEND:
+    if EMAIL_HOST:
+        EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    elif DEBUG:
+        EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+    else:
+        raise ImproperlyConfigured("Set EMAIL_HOST, or EMAIL_BACKEND for a process that sends no mail.")
+EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
@@ -1,6 +1,48 @@
+"""
+Media storage backends, chosen by the MEDIA_STORAGE setting.
+
+MediaStorage keeps uploads in S3 without talking to S3 more than it must:
+
+- Public URLs are built from the stored name alone and memoized, so
+  rendering a page of images never creates a boto client. Signed URLs
+  still go through S3Boto3Storage.
+- Upload names get a random suffix up front instead of being checked with
+  a HEAD request (or several) against the bucket, so an upload is a
+  single PUT.
+"""
+import posixpath
+from functools import lru_cache
+
+from django.utils.crypto import get_random_string
+from django.utils.encoding import filepath_to_uri
 from storages.backends.s3boto3 import S3Boto3Storage
 
+URL_CACHE_SIZE = 50_000
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def _public_url(base_url, location, name):
+    return base_url + filepath_to_uri(posixpath.join(location, name) if location else name)
+
+
 class MediaStorage(S3Boto3Storage):
     location = 'media'  # S3 folder prefix
     default_acl = None
-    file_overwrite = False
+    # Names are made unique in get_available_name, never by asking S3
+    file_overwrite = True
+
+    def _public_base_url(self):
+        domain = self.custom_domain or f"{self.bucket_name}.s3.{self.region_name}.amazonaws.com"
+        return f"{self.url_protocol}//{domain}/"
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if self.querystring_auth or parameters or http_method:
+            return super().url(name, parameters, expire, http_method)
+        return _public_url(self._public_base_url(), self.location, name.lstrip('/'))
+
+    def get_available_name(self, name, max_length=None):
+        root, ext = posixpath.splitext(name)
+        suffix = f"_{get_random_string(7)}{ext}"
+        if max_length is not None:
+            root = root[:max(max_length - len(suffix), 1)]
+        return super().get_available_name(root + suffix, max_length)
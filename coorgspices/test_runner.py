@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class StrictQueryBudgetRunner(DiscoverRunner):
+    """
+    The default runner with QUERY_BUDGET_STRICT on, so any request a test
+    makes that goes over its query budget or runs a query in a loop fails
+    that test (shop/query_budget.py).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget_strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        settings.QUERY_BUDGET_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_BUDGET_STRICT = self._query_budget_strict
+        super().teardown_test_environment(**kwargs)
@@ -28,3 +28,6 @@ urlpatterns = [
     path('logout/', logout_view, name='logout'),
     path('accounts/', include('allauth.urls')),
 ]
+
+if settings.DEBUG and settings.MEDIA_STORAGE == 'local':
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
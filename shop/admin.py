@@ -1,19 +1,32 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Lower
+from django.http import HttpResponseBadRequest
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from .models import (
     Product, Category, ProductImage, ProductVariant,
-    CustomerProfile, Address, Order, OrderItem, HomePageFeatured
+    CustomerProfile, Address, Order, OrderItem, HomePageFeatured, Job, DailySales
 )
+from .analytics import sales_report
+from .order_export import order_export_response
+from .pagination import EstimatedCountPaginator
 
 # ================= Product Inlines =================
 
 class ProductVariantInline(admin.TabularInline):
     model = ProductVariant
     extra = 1  # empty slots for variants
+    readonly_fields = ('reserved',)  # held by open checkouts
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1  # empty slots for additional images
-    fields = ('image', 'alt_text')
+    fields = ('image', 'role', 'alt_text')
 
 # ================= Product Admin =================
 
@@ -33,12 +46,73 @@ class CategoryAdmin(admin.ModelAdmin):
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
+    fields = ("variant", "product_name", "weight", "quantity", "price")
+    readonly_fields = ("product_name", "weight")
+
+    # Lines are entered with a new order and fixed after that: the sales
+    # rollups count them when they are created (see shop/analytics.py)
+    def has_add_permission(self, request, obj=None):
+        return obj is None and super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # The variant choices are labelled with their product's name
+        if db_field.name == "variant":
+            kwargs["queryset"] = ProductVariant.objects.select_related("product")
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 class OrderAdmin(admin.ModelAdmin):
     list_display = ("order_number", "user", "status", "payment_status", "total_price", "created_at")
     list_filter = ("status", "payment_status", "created_at")
-    search_fields = ("order_number", "user__username", "user__email")
+    list_select_related = ("user",)
+    # Newest first, walking shop_order_created_idx
+    ordering = ("-created_at", "-id")
+    date_hierarchy = "created_at"  # drawn by {% indexed_date_hierarchy %}, see change_list.html
+    # An exact COUNT(*) of the whole table on every page view costs more than the page
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_fields = ("order_number",)  # see get_search_results
+    search_help_text = "An order number or its first digits, or a customer's exact email or username."
     inlines = [OrderItemInline]
+    actions = ["export_csv"]
+    change_list_template = "admin/shop/order/change_list.html"
+
+    @admin.action(description="Export selected orders as CSV")
+    def export_csv(self, request, queryset):
+        return order_export_response(queryset)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only lookups that an index answers: never a LIKE '%...%' join on users
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            # Order numbers are all 8 digits, so a prefix is a range of the unique index
+            return queryset.filter(order_number__range=(term.ljust(8, "0"), term.ljust(8, "9"))), False
+        users = User.objects.alias(email_lower=Lower("email")).filter(
+            Q(email_lower=term.lower()) | Q(username=term)
+        )
+        return queryset.filter(user__in=users.values("id")), False
+
+    def get_urls(self):
+        export = path("export/", self.admin_site.admin_view(self.export_view), name="shop_order_export")
+        return [export] + super().get_urls()
+
+    def export_view(self, request):
+        """Every order matching the changelist's filters, date hierarchy and search, as CSV."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        # The changelist's own queryset, so the export can never disagree with the page
+        try:
+            orders = self.get_changelist_instance(request).get_queryset(request)
+        except IncorrectLookupParameters:
+            return HttpResponseBadRequest("Invalid filter parameters.")
+        return order_export_response(orders)
 
 # ================= HomePage Featured =================
 
@@ -46,6 +120,59 @@ class HomePageFeaturedAdmin(admin.ModelAdmin):
     filter_horizontal = ('products',)
     list_display = ('title', 'max_items')
 
+# ================= Background Jobs =================
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "priority", "attempts", "run_at", "created_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("locked_by", "locked_at", "last_error", "created_at")
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry selected jobs now")
+    def retry_now(self, request, queryset):
+        # A job whose key is already queued again is done by that job
+        queued = Job.objects.filter(status=Job.QUEUED, key=OuterRef('key'))
+        queryset.filter(status=Job.FAILED).exclude(Exists(queued)).update(
+            status=Job.QUEUED, attempts=0, run_at=timezone.now(),
+        )
+
+# ================= Sales Dashboard =================
+
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """The "Daily sales" entry opens a dashboard built from the sales rollups alone."""
+    periods = (7, 30, 90, 365)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = int(request.GET.get("days", 30))
+        except ValueError:
+            days = 30
+        days = days if days in self.periods else 30
+        report = sales_report(days=days)
+        best_day = max((row["revenue"] for row in report["daily"]), default=0) or 1
+        for row in report["daily"]:
+            row["width"] = round(100 * row["revenue"] / best_day)
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Sales",
+            "opts": self.model._meta,
+            "report": report,
+            "periods": self.periods,
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, "admin/shop/sales_dashboard.html", context)
+
 # ================= Register Models =================
 
 admin.site.register(Product, ProductAdmin)
@@ -54,3 +181,5 @@ admin.site.register(CustomerProfile)
 admin.site.register(Address)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(HomePageFeatured, HomePageFeaturedAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(DailySales, SalesDashboardAdmin)
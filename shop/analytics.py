@@ -0,0 +1,259 @@
+"""
+Sales rollups: DailySales and DailyVariantSales.
+
+Reports read these small tables instead of Order and OrderItem. Their
+size grows with days x variants sold, not with the number of orders, so a
+report costs the same at ten thousand orders as at ten million.
+
+They are kept up to date incrementally (see shop/signals.py):
+
+- Creating an Order counts it, however it is created.
+- Creating an OrderItem counts its line. place_order() inserts its items
+  with bulk_create(), which sends no signals, and calls record_items()
+  for them itself.
+- Saving an Order whose payment status, cancellation or total changed
+  moves its counts to the new bucket.
+- Deleting an Order takes its counts off.
+
+Each change is one ``INSERT ... ON CONFLICT DO UPDATE SET n = n + excluded.n``
+per table, so concurrent checkouts never lose each other's counts. The
+lines of an existing order can't be edited in the admin. Writes that skip
+the signals - QuerySet.update(), bulk_create() as in seed_shop - need a
+``manage.py rebuild_sales_rollups`` afterwards.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Category, DailySales, DailyVariantSales, Order, OrderItem, ProductVariant
+
+REBUILD_BATCH_SIZE = 2000
+
+PAID = 'Success'
+# Paid orders placed before place_order() were saved as 'Completed'
+# (migration 0034 renames them); they are counted as paid all the same
+LEGACY_PAID = 'Completed'
+
+DAILY_KEY = ('day', 'payment_status', 'cancelled')
+VARIANT_KEY = ('day', 'variant_id', 'payment_status', 'cancelled')
+
+
+def _bucket(order):
+    payment_status = PAID if order.payment_status == LEGACY_PAID else order.payment_status
+    return (timezone.localdate(order.created_at), payment_status, order.status == 'Cancelled')
+
+
+def _increment(model, key_fields, rows, conflict_fields=None):
+    """
+    Add ``rows`` ({key tuple: {counter: delta}}) to ``model``'s counters,
+    creating the rows that don't exist yet. ``conflict_fields`` is the
+    model's unique key, by default all of ``key_fields``; any other key
+    fields are only written on insert.
+    """
+    if not rows:
+        return
+    opts = model._meta
+    unique = conflict_fields or key_fields
+    counters = list(next(iter(rows.values())))
+    columns = list(key_fields) + counters
+    fields = [opts.get_field(name) for name in columns]
+    values, params = [], []
+    for key, counts in rows.items():
+        values.append('(' + ', '.join(['%s'] * len(columns)) + ')')
+        params += [
+            field.get_db_prep_save(value, connection)
+            for field, value in zip(fields, list(key) + [counts[name] for name in counters])
+        ]
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) VALUES {', '.join(values)} "
+        f"ON CONFLICT ({', '.join(qn(opts.get_field(name).column) for name in unique)}) DO UPDATE SET "
+        + ', '.join(f"{qn(name)} = {table}.{qn(name)} + excluded.{qn(name)}" for name in counters)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _apply(bucket, items, total, sign):
+    """Add (sign 1) or take off (sign -1) one order's contribution to ``bucket``."""
+    _increment(DailySales, DAILY_KEY, {bucket: {'orders': sign, 'revenue': sign * total}})
+    _apply_lines(bucket, items, sign)
+
+
+def _apply_lines(bucket, items, sign):
+    """The same for the ``items`` (variant, product, category, quantity, price) of an order."""
+    day, payment_status, cancelled = bucket
+    rows = defaultdict(lambda: {'lines': 0, 'quantity': 0, 'revenue': Decimal(0)})
+    for variant_id, product_id, category_id, quantity, price in items:
+        if variant_id is None:
+            continue  # the variant was deleted; only the order totals remember it
+        row = rows[(day, variant_id, payment_status, cancelled, product_id, category_id)]
+        row['lines'] += sign
+        row['quantity'] += sign * quantity
+        row['revenue'] += sign * quantity * price
+    _increment(DailyVariantSales, VARIANT_KEY + ('product_id', 'category_id'), dict(rows), VARIANT_KEY)
+
+
+def _order_items(order_id):
+    return list(
+        OrderItem.objects.filter(order_id=order_id)
+        .values_list('variant_id', 'variant__product_id', 'variant__product__category_id', 'quantity', 'price')
+    )
+
+
+def order_created(order):
+    _increment(DailySales, DAILY_KEY, {_bucket(order): {'orders': 1, 'revenue': order.total_price}})
+
+
+def record_items(order, items):
+    """Count the new OrderItems ``items`` of ``order``."""
+    _apply_lines(_bucket(order), [
+        (item.variant_id, item.variant.product_id, item.variant.product.category_id, item.quantity, item.price)
+        for item in items if item.variant_id
+    ], 1)
+
+
+# ====================== ORDER CHANGES ======================
+# Called by the Order signals in shop/signals.py
+
+def counted_state(order):
+    """What the rollups currently count for ``order``, read before it is saved."""
+    return (
+        Order.objects.filter(pk=order.pk)
+        .values_list('created_at', 'payment_status', 'status', 'total_price').first()
+    )
+
+
+def order_changed(order, counted):
+    """Move ``order``'s counts from its ``counted`` state to its current one."""
+    created_at, payment_status, status, total = counted
+    old = (timezone.localdate(created_at), payment_status, status == 'Cancelled')
+    new = _bucket(order)
+    if old == new:
+        if total != order.total_price:
+            _increment(DailySales, DAILY_KEY, {new: {'orders': 0, 'revenue': order.total_price - total}})
+        return
+    with transaction.atomic():
+        items = _order_items(order.pk)
+        _apply(old, items, total, -1)
+        _apply(new, items, order.total_price, 1)
+
+
+def order_deleted(order):
+    _apply(_bucket(order), _order_items(order.pk), order.total_price, -1)
+
+
+# ====================== REBUILD ======================
+
+def _cancelled(status_field):
+    return Case(When(**{status_field: 'Cancelled'}, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+def _payment(payment_field):
+    return Case(When(**{payment_field: LEGACY_PAID}, then=Value(PAID)), default=F(payment_field),
+                output_field=CharField())
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from every order. Returns (DailySales rows, DailyVariantSales rows)."""
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyVariantSales.objects.all().delete()
+
+        days = (
+            Order.objects.order_by()
+            .values(day=TruncDate('created_at'), payment=_payment('payment_status'), is_cancelled=_cancelled('status'))
+            .annotate(order_count=Count('id'), total=Sum('total_price'))
+            .iterator(chunk_size=REBUILD_BATCH_SIZE)
+        )
+        daily = DailySales.objects.bulk_create((
+            DailySales(day=row['day'], payment_status=row['payment'], cancelled=row['is_cancelled'],
+                       orders=row['order_count'], revenue=row['total'])
+            for row in days
+        ), batch_size=REBUILD_BATCH_SIZE)
+
+        lines = (
+            OrderItem.objects.filter(variant__isnull=False).order_by()
+            .values(
+                day=TruncDate('order__created_at'), variant_ref=F('variant_id'),
+                product_ref=F('variant__product_id'), category_ref=F('variant__product__category_id'),
+                payment=_payment('order__payment_status'), is_cancelled=_cancelled('order__status'),
+            )
+            .annotate(line_count=Count('id'), units=Sum('quantity'), total=Sum(F('quantity') * F('price')))
+            .iterator(chunk_size=REBUILD_BATCH_SIZE)
+        )
+        variants = DailyVariantSales.objects.bulk_create((
+            DailyVariantSales(
+                day=row['day'], variant_id=row['variant_ref'], product_id=row['product_ref'],
+                category_id=row['category_ref'], payment_status=row['payment'], cancelled=row['is_cancelled'],
+                lines=row['line_count'], quantity=row['units'], revenue=row['total'],
+            )
+            for row in lines
+        ), batch_size=REBUILD_BATCH_SIZE)
+    return len(daily), len(variants)
+
+
+# ====================== REPORTS ======================
+
+def sales_report(days=30, today=None, top=10):
+    """
+    Paid, uncancelled sales over the last ``days`` days, read from the
+    rollups only: a row per day, revenue per category and the ``top``
+    variants by revenue.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    paid = Q(day__gte=start, day__lte=today, payment_status=PAID, cancelled=False)
+
+    per_day = {
+        row['day']: row for row in
+        DailySales.objects.filter(paid).values('day', 'orders', 'revenue')
+    }
+    daily = [
+        per_day.get(start + timedelta(days=n), {'day': start + timedelta(days=n), 'orders': 0, 'revenue': Decimal(0)})
+        for n in range(days)
+    ]
+
+    variant_sales = DailyVariantSales.objects.filter(paid).order_by()
+    categories = list(
+        variant_sales.values('category_id')
+        .annotate(units=Sum('quantity'), total=Sum('revenue'))
+        .order_by('-total')
+    )
+    names = dict(Category.objects.filter(id__in=[row['category_id'] for row in categories]).values_list('id', 'name'))
+    for row in categories:
+        row['name'] = names.get(row['category_id'], f"Category {row['category_id']}")
+
+    top_variants = list(
+        variant_sales.values('variant_id')
+        .annotate(units=Sum('quantity'), total=Sum('revenue'))
+        .order_by('-total', 'variant_id')[:top]
+    )
+    variants = ProductVariant.objects.select_related('product').in_bulk([row['variant_id'] for row in top_variants])
+    for row in top_variants:
+        variant = variants.get(row['variant_id'])
+        row['name'] = str(variant) if variant else f"Variant {row['variant_id']} (deleted)"
+
+    outcomes = list(
+        DailySales.objects.filter(day__gte=start, day__lte=today).order_by()
+        .values('payment_status', 'cancelled')
+        .annotate(order_count=Sum('orders'), total=Sum('revenue'))
+        .order_by('payment_status', 'cancelled')
+    )
+    return {
+        'start': start,
+        'end': today,
+        'days': days,
+        'daily': daily,
+        'orders': sum(row['orders'] for row in daily),
+        'revenue': sum((row['revenue'] for row in daily), Decimal(0)),
+        'categories': categories,
+        'top_variants': top_variants,
+        'outcomes': outcomes,
+    }
@@ -0,0 +1,202 @@
+"""
+Read-only JSON catalog API, version 1, under /api/v1/.
+
+    GET /api/v1/categories/
+    GET /api/v1/categories/<id>/products/?cursor=...
+    GET /api/v1/products/<slug>/
+
+Product responses take ``?fields=name,price,...`` to return only some of
+PRODUCT_FIELDS; the variants and the image map are only loaded when asked
+for. Payloads are built once per catalog version and served from the
+catalog cache (shop/catalog_cache.py) after that.
+
+Every successful response carries a strong ETag made of the catalog
+version and the request URL, and ``Cache-Control: no-cache`` so clients
+revalidate each time; errors carry no ETag. A client sending the ETag back
+in If-None-Match gets a 304 after reading the version - one primary-key
+lookup - until a catalog write bumps it. The version is shared through the
+database, so writes from the job worker or the management commands
+(import_catalog, seed_shop) change the ETag too.
+
+Stock counts are not exposed: the version only moves when a variant sells
+out or is restocked, so ``in_stock`` is all that stays exact.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET
+
+from .catalog_cache import cached_catalog, catalog_version
+from .models import Category, Product, ProductVariant
+from .pagination import keyset_page, normalize_cursor
+
+API_VERSION = 1
+PRODUCT_PAGE_SIZE = 24
+
+
+def _price(value):
+    return str(value) if value is not None else None
+
+
+def _variant(variant):
+    return {
+        'id': variant.id,
+        'weight': variant.weight,
+        'price': _price(variant.price),
+        'old_price': _price(variant.old_price),
+        'in_stock': variant.stock > 0,
+    }
+
+
+CATEGORY_FIELDS = {
+    'id': lambda category: category.id,
+    'name': lambda category: category.name,
+    'image': lambda category: category.image.url if category.image else '',
+    'products': lambda category: reverse('api_category_products', args=[category.id]),
+}
+
+PRODUCT_FIELDS = {
+    'id': lambda product: product.id,
+    'name': lambda product: product.name,
+    'slug': lambda product: product.slug,
+    'category': lambda product: product.category_id,
+    'description': lambda product: product.description,
+    'url': lambda product: reverse('product_detail', args=[product.slug]),
+    'image': lambda product: product.image.url if product.image else '',
+    'images': lambda product: product.image_map,
+    'min_price': lambda product: _price(product.min_price),
+    'max_price': lambda product: _price(product.max_price),
+    'in_stock': lambda product: product.in_stock,
+    'variants': lambda product: [_variant(variant) for variant in product.variants.all()],
+}
+
+
+class InvalidFields(Exception):
+    pass
+
+
+def _selected_fields(request, available):
+    """The fields asked for in ?fields=, in ``available``'s order; all of them by default."""
+    requested = {name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()}
+    if not requested:
+        return list(available)
+    unknown = requested - set(available)
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                            f"Choose from: {', '.join(available)}.")
+    return [name for name in available if name in requested]
+
+
+def _serialize(obj, serializers, fields):
+    return {name: serializers[name](obj) for name in fields}
+
+
+def _products(queryset, fields):
+    # Only the columns and relations the response needs
+    if 'description' not in fields:
+        queryset = queryset.defer('description')
+    queryset = queryset.defer('image_renditions')
+    if 'variants' in fields:
+        queryset = queryset.prefetch_related(
+            Prefetch('variants', queryset=ProductVariant.objects.order_by('price', 'id'))
+        )
+    if 'images' in fields:
+        queryset = queryset.prefetch_related('images')
+    return queryset
+
+
+def _etag(request, *args, **kwargs):
+    digest = hashlib.sha256(request.get_full_path().encode()).hexdigest()[:16]
+    return f'"v{API_VERSION}-{catalog_version()}-{digest}"'
+
+
+def _conditional(view):
+    # Like condition(etag_func=_etag), which would also tag 400 and 404
+    # responses and let clients revalidate an error as if it were the payload.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        etag = _etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response.headers['ETag'] = etag
+        return response
+    return wrapper
+
+
+def api_view(view):
+    """GET only, revalidated on every use, answered with 304 while the catalog hasn't changed."""
+    view = _conditional(view)
+    view = cache_control(public=True, no_cache=True)(view)
+    return require_GET(view)
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+# ====================== VIEWS ======================
+
+@api_view
+def categories(request):
+    try:
+        fields = _selected_fields(request, CATEGORY_FIELDS)
+    except InvalidFields as exc:
+        return _error(str(exc), 400)
+
+    def build():
+        return {'results': [
+            _serialize(category, CATEGORY_FIELDS, fields)
+            for category in Category.objects.defer('image_renditions').order_by('name', 'id')
+        ]}
+
+    return JsonResponse(cached_catalog('api_categories', build, ','.join(fields)))
+
+
+@api_view
+def category_products(request, category_id):
+    try:
+        fields = _selected_fields(request, PRODUCT_FIELDS)
+    except InvalidFields as exc:
+        return _error(str(exc), 400)
+    cursor = normalize_cursor(request.GET.get('cursor'))
+
+    def build():
+        if not Category.objects.filter(id=category_id).exists():
+            return None
+        products, next_cursor = keyset_page(
+            _products(Product.objects.filter(category_id=category_id), fields), cursor, PRODUCT_PAGE_SIZE
+        )
+        return {
+            'results': [_serialize(product, PRODUCT_FIELDS, fields) for product in products],
+            'next_cursor': next_cursor,
+        }
+
+    payload = cached_catalog('api_category_products', build, category_id, cursor, ','.join(fields))
+    if payload is None:
+        return _error("Category not found.", 404)
+    return JsonResponse(payload)
+
+
+@api_view
+def product(request, slug):
+    try:
+        fields = _selected_fields(request, PRODUCT_FIELDS)
+    except InvalidFields as exc:
+        return _error(str(exc), 400)
+
+    def build():
+        product = _products(Product.objects.filter(slug=slug), fields).first()
+        return _serialize(product, PRODUCT_FIELDS, fields) if product else None
+
+    payload = cached_catalog('api_product', build, slug, ','.join(fields))
+    if payload is None:
+        return _error("Product not found.", 404)
+    return JsonResponse(payload)
@@ -6,3 +6,6 @@ class ShopConfig(AppConfig):
 
     def ready(self):
         import shop.signals
+        # Register the background job handlers
+        import shop.emails
+        import shop.recommendations
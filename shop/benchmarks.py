@@ -0,0 +1,246 @@
+"""
+End-to-end benchmark of every named URL in shop/urls.py.
+
+Each Scenario drives one URL through the Django test client as a guest or
+as a customer and records latency, query count and response size. Fixtures
+(a customer with orders, a popular product, ...) are picked from whatever is
+in the database, normally data from ``manage.py seed_shop``. run_benchmarks()
+rolls back everything the scenarios write, so POST endpoints can be
+measured too.
+"""
+import statistics
+import time
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import urls as shop_urls
+from .models import Address, Category, Order, Product
+
+
+@dataclass
+class Scenario:
+    name: str                           # URL name in shop/urls.py
+    label: str = ""                     # tells apart several scenarios of one URL
+    method: str = "get"
+    login: bool = False
+    kwargs: Optional[Callable] = None   # fixtures -> URL kwargs
+    data: Optional[Callable] = None     # fixtures -> GET params or POST data
+    before: Optional[Callable] = None   # (client, fixtures) -> None, not timed
+    headers: Optional[Callable] = None  # fixtures -> request headers
+
+    @property
+    def key(self):
+        return f"{self.name} ({self.label})" if self.label else self.name
+
+
+def _add_to_cart(client, fx):
+    client.post(reverse("add_to_cart"), _cart_line(fx))
+
+
+def _cart_line(fx):
+    return {"product_slug": fx.product.slug, "variant_weight": fx.variant.weight, "quantity": 1}
+
+
+def _fetch_etag(client, fx):
+    fx.etag = client.get(reverse("api_product", kwargs={"slug": fx.product.slug}))["ETag"]
+
+
+def _new_address(client, fx):
+    fx.scratch_address = Address.objects.create(
+        user=fx.user, flat="1", area="Bench Road", landmark="-", pincode="571201",
+        city="Madikeri", state="Karnataka", contact="9999999999",
+    )
+
+
+ADDRESS_FORM = {
+    "flat": "42", "area": "Coffee Estate Road", "landmark": "Temple", "pincode": "571201",
+    "city": "Madikeri", "state": "Karnataka", "contact": "9999999999",
+}
+
+SCENARIOS = [
+    # Catalog
+    Scenario("home"),
+    Scenario("category_list"),
+    Scenario("category_detail", kwargs=lambda fx: {"category_id": fx.category.id}),
+    Scenario("category_products_json", kwargs=lambda fx: {"category_id": fx.category.id}),
+    Scenario("product_detail", kwargs=lambda fx: {"slug": fx.product.slug}),
+    Scenario("search", "one word", data=lambda fx: {"q": fx.search_word}),
+    Scenario("search", "prefix", data=lambda fx: {"q": f"{fx.search_word} {fx.search_word[:4]}"}),
+    # Catalog API
+    Scenario("api_categories"),
+    Scenario("api_category_products", kwargs=lambda fx: {"category_id": fx.category.id}),
+    Scenario("api_category_products", "some fields", kwargs=lambda fx: {"category_id": fx.category.id},
+             data=lambda fx: {"fields": "id,name,min_price,in_stock"}),
+    Scenario("api_product", kwargs=lambda fx: {"slug": fx.product.slug}),
+    Scenario("api_product", "not modified", kwargs=lambda fx: {"slug": fx.product.slug},
+             before=_fetch_etag, headers=lambda fx: {"If-None-Match": fx.etag}),
+    # Accounts
+    Scenario("login"),
+    Scenario("register"),
+    Scenario("logout", before=lambda client, fx: client.force_login(fx.user)),
+    Scenario("profile", login=True),
+    Scenario("save_profile", method="post", login=True,
+             data=lambda fx: {"first_name": "Bench", "last_name": "User", "email": fx.user.email,
+                              "phone": "9999999999", "city": "Madikeri", "state": "Karnataka"}),
+    Scenario("add_address", method="post", login=True, data=lambda fx: ADDRESS_FORM),
+    Scenario("save_address", method="post", login=True,
+             kwargs=lambda fx: {"address_id": fx.address.id}, data=lambda fx: ADDRESS_FORM),
+    Scenario("delete_address", method="post", login=True, before=_new_address,
+             kwargs=lambda fx: {"address_id": fx.scratch_address.id}),
+    Scenario("password_reset"),
+    Scenario("password_reset_done"),
+    Scenario("password_reset_confirm", kwargs=lambda fx: {"uidb64": fx.uidb64, "token": fx.token}),
+    Scenario("password_reset_complete"),
+    # Cart
+    Scenario("add_to_cart", "guest", method="post", data=_cart_line),
+    Scenario("add_to_cart", "customer", method="post", login=True, data=_cart_line),
+    Scenario("cart", "guest", before=_add_to_cart),
+    Scenario("cart", "customer", login=True),
+    Scenario("update_cart_quantity", method="post", login=True, before=_add_to_cart,
+             data=lambda fx: {**_cart_line(fx), "quantity": 2}),
+    Scenario("remove_from_cart", method="post", login=True, before=_add_to_cart, data=_cart_line),
+    # Checkout and orders
+    Scenario("checkout", login=True),
+    Scenario("validate-address", login=True, kwargs=lambda fx: {"id": fx.address.id}),
+    Scenario("add_address_checkout", method="post", login=True, data=lambda fx: ADDRESS_FORM),
+    Scenario("order_confirmation", method="post", login=True, before=_add_to_cart,
+             data=lambda fx: {"payment_status": "success", "address_id": fx.address.id}),
+    Scenario("my_orders", login=True),
+    Scenario("my_orders_json", login=True),
+    Scenario("order_details", login=True, kwargs=lambda fx: {"order_id": fx.order.id}),
+]
+
+
+def load_fixtures(username=None):
+    """Pick the objects the scenarios need from the current database."""
+    users = User.objects.filter(addresses__isnull=False, order__isnull=False)
+    if username:
+        users = users.filter(username=username)
+    # The customer with the longest order history is the worst case for My Orders
+    user = users.annotate(orders=Count("order", distinct=True)).order_by("-orders", "id").first()
+    if user is None:
+        raise ValueError("Need a customer with an address and an order; run manage.py seed_shop first.")
+
+    product = (
+        Product.objects.filter(in_stock=True, cheapest_variant__isnull=False)
+        .annotate(image_count=Count("images")).order_by("-image_count", "id").first()
+    )
+    if product is None:
+        raise ValueError("Need a product with a variant in stock; run manage.py seed_shop first.")
+    category = Category.objects.annotate(products=Count("product")).order_by("-products", "id").first()
+    return SimpleNamespace(
+        user=user,
+        address=Address.objects.filter(user=user).order_by("-is_selected", "id").first(),
+        order=Order.objects.filter(user=user).order_by("-created_at").first(),
+        product=product,
+        variant=product.cheapest_variant,
+        category=category,
+        search_word=product.name.split()[-2].lower() if len(product.name.split()) > 1 else product.name.lower(),
+        uidb64=urlsafe_base64_encode(force_bytes(user.pk)),
+        token=default_token_generator.make_token(user),
+        scratch_address=None,
+        etag=None,
+    )
+
+
+def uncovered_url_names(scenarios=SCENARIOS):
+    covered = {scenario.name for scenario in scenarios}
+    return sorted(
+        pattern.name for pattern in shop_urls.urlpatterns
+        if pattern.name and pattern.name not in covered
+    )
+
+
+class _QueryCounter:
+    # Only counts; QueryRecorder's call-site capture would skew the timings
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_scenario(scenario, fixtures, iterations=50, warmup=3, cold_cache=False):
+    client = Client(raise_request_exception=False)
+    if scenario.login:
+        client.force_login(fixtures.user)
+
+    timings, query_counts, sizes, statuses = [], [], [], Counter()
+    for i in range(warmup + iterations):
+        if scenario.before:
+            scenario.before(client, fixtures)
+        if cold_cache:
+            cache.clear()
+        url = reverse(scenario.name, kwargs=scenario.kwargs(fixtures) if scenario.kwargs else None)
+        data = scenario.data(fixtures) if scenario.data else None
+        headers = scenario.headers(fixtures) if scenario.headers else None
+
+        counter = _QueryCounter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(url, data, headers=headers)
+            body = b"".join(response.streaming_content) if response.streaming else response.content
+            elapsed = (time.perf_counter() - started) * 1000
+
+        if i >= warmup:
+            timings.append(elapsed)
+            query_counts.append(counter.count)
+            sizes.append(len(body))
+            statuses[response.status_code] += 1
+
+    return {
+        "key": scenario.key,
+        "name": scenario.name,
+        "method": scenario.method.upper(),
+        "url": url,
+        "status": dict(statuses),
+        "latency_ms": {
+            "mean": round(statistics.mean(timings), 3),
+            "p50": round(percentile(timings, 50), 3),
+            "p95": round(percentile(timings, 95), 3),
+            "p99": round(percentile(timings, 99), 3),
+        },
+        "queries": {"median": statistics.median(query_counts), "max": max(query_counts)},
+        "bytes": {"median": statistics.median(sizes), "max": max(sizes)},
+    }
+
+
+def run_benchmarks(scenarios=SCENARIOS, iterations=50, warmup=3, cold_cache=False,
+                   username=None, only=None, progress=None):
+    """Run ``scenarios`` (optionally only the URL names in ``only``) and roll back their writes."""
+    results = []
+    settings_override = override_settings(
+        ALLOWED_HOSTS=["testserver"], QUERY_BUDGET_STRICT=False, QUERY_BUDGET_SAMPLE_RATE=0,
+    )
+    with settings_override, transaction.atomic():
+        fixtures = load_fixtures(username)
+        for scenario in scenarios:
+            if only and scenario.name not in only:
+                continue
+            result = run_scenario(scenario, fixtures, iterations, warmup, cold_cache)
+            results.append(result)
+            if progress:
+                progress(result)
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,207 @@
+"""
+Cart helpers shared by the cart views and the cart badge.
+
+A customer's cart lives in CartItem, a guest's in the session under
+SESSION_KEY as a flat ``{variant_id: quantity}`` dict (ids are strings, as
+JSON keys must be). The whole guest cart is resolved with one query however
+many lines it has.
+
+Every change to a customer's cart is a single statement - an
+INSERT ... ON CONFLICT that adds to the quantity, an UPDATE or a DELETE -
+relying on the unique (user, variant) constraint, so concurrent requests
+never lose an update or create duplicate lines. When a guest logs in,
+merge_session_cart() adds their whole session cart with one such upsert.
+
+The badge count of a customer is cached per user and dropped whenever their
+cart changes, so pages only run the SUM query after a cart change; a guest's
+count is read straight from the session. This needs a cache every process
+shares: with a per-process one (the default LocMemCache) another worker
+would keep showing the old count, so the count is computed on each page
+that shows the badge instead.
+"""
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .models import CartItem, ProductVariant
+
+SESSION_KEY = 'cart'
+COUNT_TIMEOUT = 60 * 60
+
+
+# ====================== GUEST CART ======================
+
+def _is_legacy(cart):
+    # Sessions from before the flat format: {product_slug: {weight: {'quantity': n}}}
+    return any(isinstance(value, dict) for value in cart.values())
+
+
+def _migrate_legacy(cart):
+    lines = {
+        (slug, weight): info['quantity']
+        for slug, variants in cart.items() for weight, info in variants.items()
+    }
+    variants = ProductVariant.objects.filter(
+        product__slug__in={slug for slug, _ in lines}
+    ).values_list('id', 'product__slug', 'weight')
+    return {
+        str(variant_id): lines[(slug, weight)]
+        for variant_id, slug, weight in variants if (slug, weight) in lines
+    }
+
+
+def session_cart(session):
+    """The guest cart as ``{variant_id: quantity}``, upgrading old sessions in place."""
+    cart = session.get(SESSION_KEY, {})
+    if _is_legacy(cart):
+        cart = _migrate_legacy(cart)
+        session[SESSION_KEY] = cart
+    return {int(variant_id): quantity for variant_id, quantity in cart.items()}
+
+
+def save_session_cart(session, cart):
+    session[SESSION_KEY] = {str(variant_id): quantity for variant_id, quantity in cart.items() if quantity > 0}
+
+
+def add_to_session_cart(session, variant_id, quantity):
+    cart = session_cart(session)
+    cart[variant_id] = cart.get(variant_id, 0) + quantity
+    save_session_cart(session, cart)
+
+
+def set_session_cart_quantity(session, variant_id, quantity):
+    """Set the quantity of a line already in the cart. Returns False if it isn't."""
+    cart = session_cart(session)
+    if variant_id not in cart:
+        return False
+    cart[variant_id] = quantity
+    save_session_cart(session, cart)
+    return True
+
+
+def remove_from_session_cart(session, variant_id):
+    cart = session_cart(session)
+    if cart.pop(variant_id, None) is not None:
+        save_session_cart(session, cart)
+
+
+def session_cart_items(session):
+    """Cart lines with their variant and product, in the order they were added."""
+    cart = session_cart(session)
+    if not cart:
+        return []
+    variants = ProductVariant.objects.filter(id__in=cart).select_related('product').in_bulk()
+    if len(variants) < len(cart):
+        # Drop lines whose variant has been deleted since
+        save_session_cart(session, {variant_id: qty for variant_id, qty in cart.items() if variant_id in variants})
+    return [
+        {
+            'product': variants[variant_id].product,
+            'variant': variants[variant_id],
+            'quantity': quantity,
+            'total_price': variants[variant_id].price * quantity,
+        }
+        for variant_id, quantity in cart.items() if variant_id in variants
+    ]
+
+
+def session_cart_count(session):
+    cart = session.get(SESSION_KEY, {})
+    if _is_legacy(cart):
+        return sum(info['quantity'] for variants in cart.values() for info in variants.values())
+    return sum(cart.values())
+
+
+# ====================== CUSTOMER CART ======================
+
+def _upsert_cart_lines(user_id, quantities):
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    # Django's bulk_create(update_conflicts=True) can only overwrite the
+    # quantity, not add to it. PostgreSQL and SQLite share this syntax.
+    sql = (
+        f"INSERT INTO {table} ({qn('user_id')}, {qn('variant_id')}, {qn('quantity')}) "
+        f"VALUES {', '.join(['(%s, %s, %s)'] * len(quantities))} "
+        f"ON CONFLICT ({qn('user_id')}, {qn('variant_id')}) "
+        f"DO UPDATE SET {qn('quantity')} = {table}.{qn('quantity')} + EXCLUDED.{qn('quantity')}"
+    )
+    params = [value for variant_id, quantity in quantities.items() for value in (user_id, variant_id, quantity)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+    cart_changed(user_id)
+
+
+def add_to_customer_cart(user_id, variant_id, quantity):
+    """Add ``quantity`` of a variant to a customer's cart in one statement."""
+    _upsert_cart_lines(user_id, {variant_id: quantity})
+
+
+def set_customer_cart_quantity(user_id, variant_id, quantity):
+    """Set the quantity of a cart line. Returns False if the line doesn't exist."""
+    updated = CartItem.objects.filter(user_id=user_id, variant_id=variant_id).update(quantity=quantity)
+    if updated:
+        cart_changed(user_id)
+    return bool(updated)
+
+
+def remove_from_customer_cart(user_id, variant_id):
+    deleted, _ = CartItem.objects.filter(user_id=user_id, variant_id=variant_id).delete()
+    if deleted:
+        cart_changed(user_id)
+
+
+def add_cart_quantities(user_id, quantities):
+    """
+    Add ``{variant_id: quantity}`` to a customer's cart with one upsert: new
+    lines are inserted and existing lines have the quantity added, atomically
+    even when two requests merge into the same cart at once. Unknown variant
+    ids are skipped.
+    """
+    variant_ids = ProductVariant.objects.filter(id__in=quantities).values_list('id', flat=True)
+    known = {variant_id: quantities[variant_id] for variant_id in variant_ids}
+    if known:
+        _upsert_cart_lines(user_id, known)
+    return len(known)
+
+
+def merge_session_cart(session, user):
+    """Move the guest cart in ``session`` into ``user``'s CartItems."""
+    cart = session_cart(session)
+    if not cart:
+        return 0
+    merged = add_cart_quantities(user.id, cart)
+    del session[SESSION_KEY]
+    return merged
+
+
+# ====================== BADGE COUNT ======================
+
+def _count_key(user_id):
+    return f'cart:count:{user_id}'
+
+
+def _cache_is_shared():
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def cart_count(request):
+    """Total quantity in the current visitor's cart."""
+    if not request.user.is_authenticated:
+        return session_cart_count(request.session)
+    if not _cache_is_shared():
+        return CartItem.objects.filter(user=request.user).aggregate(total=Sum('quantity'))['total'] or 0
+
+    key = _count_key(request.user.id)
+    count = cache.get(key)
+    if count is None:
+        count = CartItem.objects.filter(user=request.user).aggregate(total=Sum('quantity'))['total'] or 0
+        cache.add(key, count, COUNT_TIMEOUT)
+    return count
+
+
+def cart_changed(user_id):
+    """Drop the cached count of ``user_id`` once the current transaction commits."""
+    # Dropping it earlier would let a concurrent page cache the old count again
+    transaction.on_commit(lambda: cache.delete(_count_key(user_id)))
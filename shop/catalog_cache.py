@@ -0,0 +1,140 @@
+"""
+Versioned cache for the catalog pages.
+
+Every cached catalog value - evaluated querysets and rendered template
+fragments - carries the current catalog version in its key. The signals in
+shop/signals.py bump the version on any catalog write, once it commits,
+which makes every older entry unreachable at once; those entries then age
+out on their own.
+
+The version is a row in the database (CatalogState), not a cache key: the
+default cache is per process, and catalog writes also come from the job
+worker and from management commands. Reading it is one primary-key lookup,
+so the entries themselves can live in any cache, shared or not. It is read
+at most once per request.
+
+Hits and misses are counted per entry name so the hit ratio can be read
+back with ``manage.py catalog_cache_stats``.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models import F
+
+TIMEOUT = 60 * 15
+
+# Names of everything cached through this module, for the stats command
+CACHED_NAMES = (
+    'home',
+    'home_grid',
+    'category_list',
+    'category_list_grid',
+    'category_detail',
+    'category_detail_grid',
+    'api_categories',
+    'api_category_products',
+    'api_product',
+)
+
+_MISSING = object()
+
+
+# The version read by the current request, if any
+_request = threading.local()
+
+
+def _forget_version(**kwargs):
+    _request.version = None
+    _request.active = kwargs.get('signal') is request_started
+
+
+request_started.connect(_forget_version)
+request_finished.connect(_forget_version)
+
+
+def _state():
+    from .models import CatalogState
+
+    # Start from the clock so a recreated row can never bring back entries
+    # cached under an older version.
+    state, _ = CatalogState.objects.get_or_create(pk=1, defaults={'version': time.time_ns()})
+    return state
+
+
+def catalog_version():
+    from .models import CatalogState
+
+    version = getattr(_request, 'version', None)
+    if version is None:
+        version = CatalogState.objects.filter(pk=1).values_list('version', flat=True).first()
+        if version is None:
+            version = _state().version
+        if getattr(_request, 'active', False):
+            _request.version = version
+    return version
+
+
+def _bump():
+    from .models import CatalogState
+
+    _request.version = None
+    if not CatalogState.objects.filter(pk=1).update(version=F('version') + 1):
+        _state()
+
+
+def bump_catalog_version():
+    # Only once the write is visible: a request running between a bump and
+    # the commit would read the old rows and cache them under the new version
+    transaction.on_commit(_bump)
+
+
+def _stats_key(name, kind):
+    return f'catalog:stats:{name}:{kind}'
+
+
+def _count(name, kind):
+    key = _stats_key(name, kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cached_catalog(name, builder, *parts, timeout=TIMEOUT):
+    """
+    Return the cached value of ``name`` (varied by ``parts``) for the current
+    catalog version, calling ``builder()`` to produce it on a miss. The
+    builder must return something picklable, e.g. a list rather than a
+    queryset.
+    """
+    key = ':'.join(['catalog', str(catalog_version()), name, *map(str, parts)])
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count(name, 'hits')
+        return value
+
+    _count(name, 'misses')
+    value = builder()
+    cache.set(key, value, timeout)
+    return value
+
+
+def catalog_cache_stats():
+    """Return {name: {'hits': n, 'misses': n}} for every cached name."""
+    keys = {
+        (name, kind): _stats_key(name, kind)
+        for name in CACHED_NAMES for kind in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    return {
+        name: {kind: values.get(keys[(name, kind)], 0) for kind in ('hits', 'misses')}
+        for name in CACHED_NAMES
+    }
+
+
+def reset_catalog_cache_stats():
+    cache.delete_many([_stats_key(name, kind) for name in CACHED_NAMES for kind in ('hits', 'misses')])
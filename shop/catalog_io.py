@@ -0,0 +1,458 @@
+"""
+Bulk catalog import and export.
+
+A catalog file describes products, their variants and their gallery images,
+as CSV or JSON Lines:
+
+- CSV has one row per variant (CSV_COLUMNS). The product columns repeat on
+  every row of a product and the rows of a product must be adjacent. The
+  ``images`` column, read from the product's first row, is a JSON list like
+  the one in JSONL.
+- JSONL has one product per line:
+  {"slug", "name", "category", "description", "image",
+   "variants": [{"weight", "price", "old_price", "stock"}],
+   "images": [{"image", "role", "alt_text"}]}
+
+``image`` values are names of files already in media storage, as the export
+writes them.
+
+import_catalog() reads the file as a stream, BATCH_SIZE products at a time,
+so memory stays flat however big the file is. Each batch is compared with
+the database in a few queries. Only new or changed rows are written, with
+one bulk upsert on Product.slug and one on (product, weight) for the
+variants. A product's gallery is replaced only when it is listed and
+differs. Variants missing from the file are left alone. With ``dry_run``
+nothing is written, and every difference is reported instead.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import groupby, islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .catalog_cache import bump_catalog_version
+from .models import Category, Product, ProductImage, ProductVariant
+from .search import index_products
+
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+VARIANT_FIELDS = ('price', 'old_price', 'stock')
+CSV_COLUMNS = ('slug', 'name', 'category', 'description', 'image', 'weight', 'price', 'old_price', 'stock', 'images')
+
+
+class CatalogError(ValueError):
+    pass
+
+
+@dataclass
+class ImportStats:
+    products_created: int = 0
+    products_updated: int = 0
+    products_unchanged: int = 0
+    variants_created: int = 0
+    variants_updated: int = 0
+    variants_unchanged: int = 0
+    galleries_replaced: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"line {line}: {message}")
+
+    @property
+    def products(self):
+        return self.products_created + self.products_updated + self.products_unchanged
+
+    @property
+    def variants(self):
+        return self.variants_created + self.variants_updated + self.variants_unchanged
+
+    def summary(self):
+        return (
+            f"products: {self.products_created} new, {self.products_updated} changed, "
+            f"{self.products_unchanged} unchanged; variants: {self.variants_created} new, "
+            f"{self.variants_updated} changed, {self.variants_unchanged} unchanged; "
+            f"{self.galleries_replaced} galleries replaced; {self.error_count} errors"
+        )
+
+
+# ====================== READING ======================
+
+def _csv_records(lines):
+    reader = csv.DictReader(lines)
+    missing = {'slug', 'name', 'weight', 'price'} - set(reader.fieldnames or ())
+    if missing:
+        raise CatalogError(f"CSV header lacks {', '.join(sorted(missing))}")
+    numbered = ((reader.line_num, row) for row in reader)
+    for slug, rows in groupby(numbered, key=lambda item: item[1]['slug'].strip()):
+        rows = list(rows)
+        line, first = rows[0]
+        record = {key: first.get(key) for key in ('slug', 'name', 'category', 'description', 'image')}
+        record['variants'] = [
+            {key: row.get(key) for key in ('weight', 'price', 'old_price', 'stock')}
+            for _, row in rows if (row.get('weight') or '').strip()
+        ]
+        images = (first.get('images') or '').strip()
+        try:
+            record['images'] = json.loads(images) if images else None
+        except ValueError:
+            record['images'] = images  # rejected by _clean with the line number
+        yield line, record
+
+
+def _jsonl_records(lines):
+    for line, text in enumerate(lines, 1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as exc:
+                yield line, exc
+
+
+def read_records(lines, file_format):
+    """Yield (line number, raw product record) from CSV or JSONL ``lines``."""
+    if file_format == 'csv':
+        return _csv_records(lines)
+    if file_format == 'jsonl':
+        return _jsonl_records(lines)
+    raise CatalogError(f"Unknown catalog format {file_format!r}")
+
+
+# Every value is checked against its column here, so that a bad record is
+# reported with its line number instead of failing a batch's INSERT
+MAX_STOCK = 2147483647  # PositiveIntegerField on every backend
+
+
+def _max_length(model, name):
+    return model._meta.get_field(name).max_length
+
+
+def _text(container, key, name, model=None, column=None):
+    value = container.get(key)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise CatalogError(f"{name} must be text, not {value!r}")
+    value = value.strip()
+    limit = _max_length(model, column or key) if model else None
+    if limit and len(value) > limit:
+        raise CatalogError(f"{name} is longer than {limit} characters")
+    return value
+
+
+def _text_block(container, key):
+    # Free text keeps its whitespace
+    value = container.get(key)
+    if value is not None and not isinstance(value, str):
+        raise CatalogError(f"{key} must be text, not {value!r}")
+    return value or ''
+
+
+def _decimal(value, name, required=True):
+    if value in (None, ''):
+        if required:
+            raise CatalogError(f"{name} is required")
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        raise CatalogError(f"{name} {value!r} is not a number")
+    field = ProductVariant._meta.get_field('price')
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise CatalogError(f"{name} {value!r} is not a number")
+    if not number.is_finite() or number < 0:
+        raise CatalogError(f"{name} {value!r} must be a positive number")
+    try:
+        number = number.quantize(Decimal(1).scaleb(-field.decimal_places))
+    except InvalidOperation:  # more digits than the context holds
+        raise CatalogError(f"{name} {value!r} is too large")
+    if len(number.as_tuple().digits) > field.max_digits:
+        raise CatalogError(f"{name} {value!r} is too large")
+    return number
+
+
+def _clean(record):
+    if isinstance(record, Exception):
+        raise CatalogError(f"invalid JSON: {record}")
+    if not isinstance(record, dict):
+        raise CatalogError("expected an object")
+    slug = _text(record, 'slug', "slug", Product)
+    name = _text(record, 'name', "name", Product)
+    if not slug or not name:
+        raise CatalogError("slug and name are required")
+    try:
+        # Product URLs only reverse for <slug:...> values
+        validate_slug(slug)
+    except ValidationError:
+        raise CatalogError(f"slug {slug!r} may only contain letters, numbers, hyphens and underscores")
+
+    raw_variants = record.get('variants') or []
+    if not isinstance(raw_variants, list) or not all(isinstance(v, dict) for v in raw_variants):
+        raise CatalogError("variants must be a list of objects")
+    variants = {}
+    for variant in raw_variants:
+        weight = _text(variant, 'weight', "weight", ProductVariant)
+        if not weight:
+            raise CatalogError("every variant needs a weight")
+        stock = variant.get('stock')
+        try:
+            if isinstance(stock, bool) or not isinstance(stock, (str, int, type(None))):
+                raise TypeError
+            stock = int(stock) if stock not in (None, '') else 0
+        except (TypeError, ValueError):
+            raise CatalogError(f"stock {stock!r} of {weight} is not a whole number")
+        if stock < 0:
+            raise CatalogError(f"stock of {weight} is negative")
+        if stock > MAX_STOCK:
+            raise CatalogError(f"stock of {weight} is too large")
+        variants[weight] = {
+            'price': _decimal(variant.get('price'), f"price of {weight}"),
+            'old_price': _decimal(variant.get('old_price'), f"old_price of {weight}", required=False),
+            'stock': stock,
+        }
+
+    images = record.get('images')
+    if images is not None:
+        if not isinstance(images, list) or not all(isinstance(i, dict) and i.get('image') for i in images):
+            raise CatalogError("images must be a list of objects with an image")
+        roles = {choice for choice, _ in ProductImage.ROLE_CHOICES}
+        images = [
+            (
+                _text(i, 'image', "image", ProductImage),
+                _text(i, 'role', "image role") or ProductImage.ROLE_GALLERY,
+                _text(i, 'alt_text', "alt_text", ProductImage),
+            )
+            for i in images
+        ]
+        if any(role not in roles for _, role, _ in images):
+            raise CatalogError(f"image roles must be one of {', '.join(sorted(roles))}")
+
+    return {
+        'slug': slug,
+        'name': name,
+        'category': _text(record, 'category', "category", Category, 'name'),
+        'description': _text_block(record, 'description'),
+        'image': _text(record, 'image', "image", Product),
+        'variants': variants,
+        'images': images,
+    }
+
+
+# ====================== IMPORT ======================
+
+def _import_batch(batch, categories, stats, dry_run, report):
+    unique = {}
+    for line, record in batch:
+        if record['slug'] in unique:
+            stats.error(line, f"{record['slug']} appears twice; the rows of a product must be adjacent")
+        else:
+            unique[record['slug']] = (line, record)
+    products = {product.slug: product for product in Product.objects.filter(slug__in=unique)}
+    records = []
+    for slug, (line, record) in unique.items():
+        if not record['category'] and slug not in products:
+            stats.error(line, f"new product {slug} needs a category")
+        else:
+            records.append(record)
+    slugs = [record['slug'] for record in records]
+    # Only products already in the database can have variants or images
+    slug_of = {product.id: slug for slug, product in products.items()}
+    variants = {
+        (slug_of[variant.product_id], variant.weight): variant
+        for variant in ProductVariant.objects.filter(product_id__in=slug_of)
+    }
+    galleries = {}
+    for image in ProductImage.objects.filter(product_id__in=slug_of).order_by('id'):
+        galleries.setdefault(slug_of[image.product_id], []).append((image.image.name, image.role, image.alt_text))
+
+    new_categories = {record['category'] for record in records} - categories.keys() - {''}
+    if new_categories and not dry_run:
+        for category in Category.objects.bulk_create([Category(name=name) for name in sorted(new_categories)]):
+            categories[category.name] = category.id
+    for name in new_categories:
+        report(f"+ category {name}")
+
+    # Prices, stock and images aren't searchable; only these changes need reindexing
+    reindex = set()
+    product_rows = []
+    for record in records:
+        current = products.get(record['slug'])
+        values = {
+            'name': record['name'],
+            'category_id': categories.get(record['category']),
+            'description': record['description'],
+            'image': record['image'],
+        }
+        if current is None:
+            stats.products_created += 1
+            reindex.add(record['slug'])
+            report(f"+ product {record['slug']}")
+        else:
+            if not record['category']:
+                values['category_id'] = current.category_id
+            old = {
+                'name': current.name, 'category_id': current.category_id,
+                'description': current.description, 'image': current.image.name,
+            }
+            changed = [key for key in values if values[key] != old[key]]
+            if not changed:
+                stats.products_unchanged += 1
+                continue
+            stats.products_updated += 1
+            if set(changed) - {'image'}:
+                reindex.add(record['slug'])
+            report(f"~ product {record['slug']}: {', '.join(key.removesuffix('_id') for key in changed)}")
+        product_rows.append(Product(slug=record['slug'], **values))
+
+    variant_rows = []
+    for record in records:
+        for weight, values in record['variants'].items():
+            current = variants.get((record['slug'], weight))
+            if current is None:
+                stats.variants_created += 1
+                reindex.add(record['slug'])
+                report(f"+ variant {record['slug']} {weight}: {values['price']}")
+            else:
+                changed = [key for key in VARIANT_FIELDS if getattr(current, key) != values[key]]
+                if not changed:
+                    stats.variants_unchanged += 1
+                    continue
+                stats.variants_updated += 1
+                report(f"~ variant {record['slug']} {weight}: " + ", ".join(
+                    f"{key} {getattr(current, key)} -> {values[key]}" for key in changed
+                ))
+            variant_rows.append((record['slug'], weight, values))
+
+    gallery_rows = {
+        record['slug']: record['images'] for record in records
+        if record['images'] is not None and record['images'] != galleries.get(record['slug'], [])
+    }
+    for slug in gallery_rows:
+        stats.galleries_replaced += 1
+        report(f"~ gallery {slug}")
+
+    if dry_run:
+        return
+
+    Product.objects.bulk_create(
+        product_rows, update_conflicts=True, unique_fields=['slug'],
+        update_fields=['name', 'category', 'description', 'image'],
+    )
+    ids = dict(Product.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+    # The queryset's bulk_create refreshes the price summaries of the products it touched
+    ProductVariant.objects.bulk_create(
+        [ProductVariant(product_id=ids[slug], weight=weight, **values) for slug, weight, values in variant_rows],
+        update_conflicts=True, unique_fields=['product', 'weight'], update_fields=list(VARIANT_FIELDS),
+    )
+    if gallery_rows:
+        ProductImage.objects.filter(product_id__in=[ids[slug] for slug in gallery_rows]).delete()
+        ProductImage.objects.bulk_create([
+            ProductImage(product_id=ids[slug], image=image, role=role, alt_text=alt_text)
+            for slug, images in gallery_rows.items() for image, role, alt_text in images
+        ])
+
+    if reindex:
+        index_products([ids[slug] for slug in reindex])
+    if product_rows or variant_rows or gallery_rows:
+        bump_catalog_version()
+
+
+def import_catalog(lines, file_format, batch_size=BATCH_SIZE, dry_run=False, report=None, progress=None):
+    """
+    Import the catalog in ``lines``. ``report`` receives one line per
+    difference found, ``progress`` the running ImportStats after every
+    batch. Each batch commits on its own. Returns the ImportStats.
+    """
+    report = report or (lambda line: None)
+    stats = ImportStats()
+    categories = {}
+    for category_id, name in Category.objects.order_by('-id').values_list('id', 'name'):
+        categories[name] = category_id  # the oldest category wins a name clash
+
+    def clean_records():
+        for line, record in read_records(lines, file_format):
+            try:
+                yield line, _clean(record)
+            except CatalogError as exc:
+                stats.error(line, exc)
+
+    records = clean_records()
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        with transaction.atomic():
+            _import_batch(batch, categories, stats, dry_run, report)
+        if progress:
+            progress(stats)
+    return stats
+
+
+# ====================== EXPORT ======================
+
+def _export_records():
+    products = (
+        Product.objects.select_related('category')
+        .prefetch_related(
+            Prefetch('variants', queryset=ProductVariant.objects.order_by('price', 'id')),
+            Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+        )
+        .order_by('id')
+    )
+    # With prefetch_related, iterator() prefetches one chunk at a time
+    for product in products.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.name,
+            'description': product.description,
+            'image': product.image.name or '',
+            'variants': [
+                {
+                    'weight': variant.weight,
+                    'price': str(variant.price),
+                    'old_price': str(variant.old_price) if variant.old_price is not None else None,
+                    'stock': variant.stock,
+                }
+                for variant in product.variants.all()
+            ],
+            'images': [
+                {'image': image.image.name, 'role': image.role, 'alt_text': image.alt_text}
+                for image in product.images.all()
+            ],
+        }
+
+
+def export_catalog(out, file_format):
+    """Write the whole catalog to the text stream ``out``. Returns the number of products."""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(CSV_COLUMNS)
+        for record in _export_records():
+            product = [record[key] for key in CSV_COLUMNS[:5]]
+            images = json.dumps(record['images'], ensure_ascii=False) if record['images'] else ''
+            if not record['variants']:
+                writer.writerow(product + ['', '', '', '', images])
+            for i, variant in enumerate(record['variants']):
+                writer.writerow(product + [
+                    variant['weight'], variant['price'], variant['old_price'] or '', variant['stock'],
+                    images if i == 0 else '',
+                ])
+            count += 1
+    elif file_format == 'jsonl':
+        for record in _export_records():
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    else:
+        raise CatalogError(f"Unknown catalog format {file_format!r}")
+    return count
@@ -1,9 +1,9 @@
-from .models import CartItem
-from django.db.models import Sum
+from django.utils.functional import SimpleLazyObject
+
+from .cart import cart_count
+
 
 def cart_item_count(request):
-    if request.user.is_authenticated:
-        count = CartItem.objects.filter(user=request.user).aggregate(total_qty=Sum('quantity'))['total_qty'] or 0
-    else:
-        count = 0
-    return {'cart_item_count': count}
+    # Lazy so pages without the cart badge (admin, password reset, ...) never
+    # compute it
+    return {'cart_item_count': SimpleLazyObject(lambda: cart_count(request))}
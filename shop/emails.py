@@ -0,0 +1,67 @@
+"""
+Outgoing email, sent by the job worker rather than inside the request.
+
+Messages are rendered in the request and queued as a ``send_email`` job,
+so the only work left for the worker is the SMTP conversation. Order
+confirmations are rendered by the worker instead, from the order id.
+"""
+from django.conf import settings
+from django.contrib.auth.forms import PasswordResetForm
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+
+from .jobs import PRIORITY_HIGH, PRIORITY_NORMAL, enqueue, job
+from .models import Order
+
+
+def queue_email(subject, body, to, from_email=None, html=None, priority=PRIORITY_NORMAL):
+    return enqueue('send_email', {
+        'subject': subject,
+        'body': body,
+        'to': list(to),
+        'from_email': from_email,
+        'html': html,
+    }, priority=priority)
+
+
+@job('send_email')
+def send_email(subject, body, to, from_email=None, html=None):
+    message = EmailMultiAlternatives(subject, body, from_email, to)
+    if html:
+        message.attach_alternative(html, 'text/html')
+    message.send()
+
+
+# ====================== PASSWORD RESET ======================
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        # Rendered like PasswordResetForm.send_mail, then queued; the customer
+        # is waiting for this one, so it jumps the queue
+        subject = "".join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html = None
+        if html_email_template_name is not None:
+            html = loader.render_to_string(html_email_template_name, context)
+        queue_email(subject, body, [to_email], from_email, html, priority=PRIORITY_HIGH)
+
+
+# ====================== ORDERS ======================
+
+def queue_order_confirmation(order):
+    return enqueue('order_confirmation_email', {'order_id': order.id})
+
+
+@job('order_confirmation_email')
+def send_order_confirmation(order_id):
+    order = (
+        Order.objects.select_related('user').with_items()
+        .filter(id=order_id).first()
+    )
+    if order is None or not order.user.email:
+        return
+    context = {'order': order, 'items': order.items.all(), 'site_name': 'Coorg Spices Emporium'}
+    subject = "".join(loader.render_to_string('shop/emails/order_confirmation_subject.txt', context).splitlines())
+    body = loader.render_to_string('shop/emails/order_confirmation.txt', context)
+    send_email(subject, body, [order.user.email], getattr(settings, 'DEFAULT_FROM_EMAIL', None))
@@ -0,0 +1,134 @@
+"""
+Responsive image renditions.
+
+Every uploaded product, gallery and category image is resized to each width
+in WIDTHS that is narrower than the original, and each size is saved as
+WebP and JPEG through the field's storage. The names and dimensions are
+recorded in the model's image_renditions column, so the
+``{% responsive_image %}`` tag can write ``srcset`` without a query or a
+storage call.
+
+Saving a new image queues an ``image_renditions`` job (see shop/jobs.py),
+so the resizing happens in the worker and never in the admin's request.
+``manage.py build_image_renditions`` backfills existing images in parallel
+processes.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .catalog_cache import bump_catalog_version
+from .jobs import PRIORITY_LOW, enqueue, job
+from .models import RENDITIONS_FIELD, Category, Product, ProductImage
+
+logger = logging.getLogger('shop.images')
+
+WIDTHS = (240, 480, 960, 1440)
+FORMATS = (
+    # (extension, Pillow format, save options)
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+RENDITIONS_DIR = 'renditions'
+
+# The models with an image field called "image" and a renditions column
+IMAGE_MODELS = {model._meta.label_lower: model for model in (Product, ProductImage, Category)}
+
+
+def _open(fieldfile):
+    with fieldfile.open('rb'):
+        image = Image.open(fieldfile)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def _encode(image, pillow_format, options):
+    if pillow_format == 'JPEG' and image.mode == 'RGBA':
+        # JPEG has no alpha channel; put transparent images on white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def build_renditions(fieldfile):
+    """Resize and save the renditions of ``fieldfile``; return the record to store."""
+    source = _open(fieldfile)
+    width, height = source.size
+    # An image narrower than every width is still re-encoded at its own size
+    widths = [w for w in WIDTHS if w < width] or [width]
+    stem = posixpath.splitext(fieldfile.name)[0]
+
+    renditions = []
+    for target in widths:
+        size = (target, max(1, round(height * target / width)))
+        resized = source if target == width else source.resize(size, Image.Resampling.LANCZOS)
+        for extension, pillow_format, options in FORMATS:
+            name = fieldfile.storage.save(
+                f"{RENDITIONS_DIR}/{stem}-{target}w.{extension}", _encode(resized, pillow_format, options)
+            )
+            renditions.append({'width': size[0], 'height': size[1], 'format': extension, 'name': name})
+    return {'source': fieldfile.name, 'width': width, 'height': height, 'renditions': renditions}
+
+
+def _delete_files(storage, record):
+    for rendition in record.get('renditions', []):
+        try:
+            storage.delete(rendition['name'])
+        except Exception:
+            logger.warning("Could not delete rendition %s", rendition['name'], exc_info=True)
+
+
+@job('image_renditions')
+def render_instance(model, pk, force=False):
+    """
+    Bring the renditions of one object up to date with its image. Returns
+    True if new renditions were written.
+    """
+    model = IMAGE_MODELS[model]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return False
+    fieldfile = instance.image
+    previous = getattr(instance, RENDITIONS_FIELD) or {}
+    if not force and previous.get('source') == (fieldfile.name or None):
+        return False
+
+    record = {}
+    if fieldfile:
+        try:
+            record = build_renditions(fieldfile)
+        except FileNotFoundError:
+            logger.warning("%s %s: image %s is missing", model.__name__, pk, fieldfile.name)
+            record = {'source': fieldfile.name, 'renditions': []}
+
+    # Only store them if the image hasn't been replaced meanwhile; the new
+    # image has its own job queued
+    updated = model.objects.filter(pk=pk, image=fieldfile.name).update(**{RENDITIONS_FIELD: record})
+    storage = fieldfile.storage
+    if not updated:
+        _delete_files(storage, record)
+        return False
+    kept = {rendition['name'] for rendition in record.get('renditions', [])}
+    _delete_files(storage, {'renditions': [r for r in previous.get('renditions', []) if r['name'] not in kept]})
+    # Cached catalog fragments still point at the original image
+    bump_catalog_version()
+    return True
+
+
+def queue_renditions(instance):
+    """Queue a renditions job if ``instance``'s image has changed since its renditions were made."""
+    record = getattr(instance, RENDITIONS_FIELD) or {}
+    if record.get('source') != (instance.image.name or None):
+        label = instance._meta.label_lower
+        enqueue('image_renditions', {'model': label, 'pk': instance.pk},
+                priority=PRIORITY_LOW, key=f'image_renditions:{label}:{instance.pk}')
+
@@ -0,0 +1,147 @@
+"""
+Database-backed background jobs.
+
+enqueue() inserts a Job row in the caller's transaction, so a job is only
+ever run for work that was committed, and is never lost once it was. The
+worker (``manage.py run_jobs``) claims batches of due jobs, lowest priority
+number first, and runs the handler registered for each job's name with the
+job's payload as keyword arguments.
+
+Claiming is a SELECT ... FOR UPDATE SKIP LOCKED followed by an UPDATE that
+only takes rows still queued, so any number of workers can share the table.
+SQLite has no row locks; there the conditional UPDATE alone decides which
+worker wins each row, and each worker reads back the rows carrying its own
+claim token.
+
+A job that raises is retried with exponential backoff until it has run
+max_attempts times, then kept as failed for the admin. A job still
+running after LOCK_TIMEOUT is assumed to belong to a dead worker and is
+queued again. Jobs can run more than once, so handlers must be safe to
+repeat.
+"""
+import logging
+import random
+import traceback
+import uuid
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('shop.jobs')
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 100
+PRIORITY_LOW = 200
+
+BATCH_SIZE = 20
+BACKOFF_BASE = 30  # seconds before the first retry, doubled for each further one
+BACKOFF_MAX = 60 * 60
+LOCK_TIMEOUT = timedelta(minutes=15)
+
+_handlers = {}
+
+
+class UnknownJob(Exception):
+    pass
+
+
+def job(name):
+    """Register the decorated function as the handler of jobs called ``name``."""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, priority=PRIORITY_NORMAL, delay=None, max_attempts=5, key=None):
+    """
+    Queue a job. With a ``key``, nothing is queued while a job with the same
+    key is still waiting to run.
+    """
+    job = Job(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        run_at=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts,
+        key=key,
+    )
+    if key is None:
+        job.save()
+    else:
+        Job.objects.bulk_create([job], ignore_conflicts=True)
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait after the ``attempts``-th failed run, with jitter."""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(worker, batch_size=BATCH_SIZE):
+    """Mark up to ``batch_size`` due jobs as running for ``worker`` and return them."""
+    now = timezone.now()
+    token = f"{worker}:{uuid.uuid4().hex[:8]}"
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('priority', 'run_at', 'id')
+    # A transaction only helps where it holds row locks; on SQLite it would
+    # make concurrent workers deadlock upgrading their read locks
+    locking = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic() if locking else nullcontext():
+        ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(id__in=ids, locked_by=token, status=Job.RUNNING).order_by('priority', 'run_at', 'id'))
+
+
+def _failed(job, error):
+    if job.attempts >= job.max_attempts:
+        changes = {'status': Job.FAILED}
+        logger.error("Job %s failed for good after %d attempts:\n%s", job, job.attempts, error)
+    else:
+        changes = {'status': Job.QUEUED, 'run_at': timezone.now() + timedelta(seconds=backoff(job.attempts))}
+        logger.warning("Job %s failed, retrying at %s:\n%s", job, changes['run_at'], error)
+    try:
+        with transaction.atomic():
+            Job.objects.filter(id=job.id).update(last_error=error, locked_by='', locked_at=None, **changes)
+    except IntegrityError:
+        # The same key was queued again meanwhile; that job will do the work
+        Job.objects.filter(id=job.id).delete()
+
+
+def run_job(job):
+    """Run one claimed job. Returns True if it succeeded."""
+    try:
+        handler = _handlers.get(job.name)
+        if handler is None:
+            raise UnknownJob(f"No handler registered for {job.name!r}")
+        handler(**job.payload)
+    except Exception:
+        _failed(job, traceback.format_exc())
+        return False
+    return True
+
+
+def run_batch(worker, batch_size=BATCH_SIZE):
+    """Claim and run one batch. Returns the number of jobs claimed."""
+    jobs = claim(worker, batch_size)
+    done = [job.id for job in jobs if run_job(job)]
+    if done:
+        Job.objects.filter(id__in=done).delete()
+    return len(jobs)
+
+
+def requeue_stale(timeout=LOCK_TIMEOUT):
+    """Queue again the jobs of workers that died mid-job. Returns how many."""
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - timeout)
+    # Where the same key has been queued again meanwhile, that job will do the work
+    stale.filter(Exists(Job.objects.filter(status=Job.QUEUED, key=OuterRef('key')))).delete()
+    return stale.update(status=Job.QUEUED, locked_by='', locked_at=None)
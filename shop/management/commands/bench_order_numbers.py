@@ -0,0 +1,70 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from shop.models import Order
+from shop.order_numbers import next_order_number
+from shop.query_budget import QueryRecorder
+
+
+def legacy_order_number():
+    # The generator Order.save used before shop/order_numbers.py
+    while True:
+        num = str(uuid.uuid4().int)[:8]
+        if not Order.objects.filter(order_number=num).exists():
+            return num
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare order insert throughput of the old random + exists() order "
+        "number generator with the keyed permutation in shop/order_numbers.py. "
+        "Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=2000, help="Orders inserted per generator.")
+        parser.add_argument("--existing", type=int, default=0,
+                            help="Orders with random numbers to add to the table first.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by("id").first()
+        if user is None:
+            raise CommandError("Need at least one user; run manage.py seed_shop first.")
+
+        with transaction.atomic():
+            if options["existing"]:
+                self.fill(user, options["existing"], random.Random(options["seed"]))
+            self.stdout.write(f"{Order.objects.count()} orders in the table ({connection.vendor})")
+            for label, generator in (("before (random + exists)", legacy_order_number),
+                                     ("after (keyed permutation)", next_order_number)):
+                self.measure(label, user, options["orders"], generator)
+            transaction.set_rollback(True)
+
+    def fill(self, user, count, rng):
+        numbers = set(Order.objects.values_list("order_number", flat=True))
+        orders = []
+        while len(orders) < count:
+            number = f"{rng.randrange(10 ** 7, 10 ** 8)}"
+            if number not in numbers:
+                numbers.add(number)
+                orders.append(Order(user=user, total_price=0, order_number=number))
+        Order.objects.bulk_create(orders, batch_size=2000)
+
+    def measure(self, label, user, count, generator):
+        with QueryRecorder() as recorder:
+            started = time.perf_counter()
+            for _ in range(count):
+                # Each order in its own savepoint, like a request's transaction
+                with transaction.atomic():
+                    Order.objects.create(user=user, total_price=0, order_number=generator())
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:<28} {count / elapsed:>9.0f} orders/s  "
+            f"{elapsed / count * 1000:.3f} ms/order  {recorder.count / count:.2f} queries/order"
+        )
@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+
+from shop.search import rebuild_index, search_products, tokenize
+from shop.synthetic import ADJECTIVES, SPICES, WEIGHTS, seed_catalog, zipf_vocabulary
+from shop.views import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark product search on a synthetic catalog. The catalog is "
+        "created inside a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=1000)
+        parser.add_argument("--budget-ms", type=float, default=20.0,
+                            help="Fail if the p99 view latency exceeds this.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            self.seed_catalog(options["products"], rng)
+            started = time.perf_counter()
+            rebuild_index()
+            self.stdout.write(f"Indexed {options['products']} products in "
+                              f"{time.perf_counter() - started:.1f}s")
+
+            queries = self.make_queries(options["queries"], rng)
+            service = self.measure(queries, lambda q: list(search_products(q).object_list))
+
+            factory = RequestFactory()
+
+            def run_view(query):
+                request = factory.get("/search/", {"q": query})
+                request.user = AnonymousUser()
+                request.session = SessionBase()
+                search(request)
+
+            view = self.measure(queries, run_view)
+            transaction.set_rollback(True)
+
+        self.report("search_products()", service)
+        self.report("search view", view)
+        p99 = self.percentile(view, 99)
+        if p99 > options["budget_ms"]:
+            raise CommandError(f"p99 {p99:.2f} ms exceeds budget of {options['budget_ms']} ms")
+
+    def seed_catalog(self, count, rng):
+        words, word_weights = zipf_vocabulary(3000, rng)
+        seed_catalog(rng, count, categories=len(ADJECTIVES), prefix="bench",
+                     vocabulary=(words, word_weights))
+        self._vocabulary = words
+
+    def make_queries(self, count, rng):
+        queries = []
+        for _ in range(count):
+            kind = rng.random()
+            if kind < 0.4:
+                queries.append(rng.choice(SPICES))
+            elif kind < 0.6:
+                queries.append(f"{rng.choice(ADJECTIVES)} {rng.choice(SPICES)}")
+            elif kind < 0.8:
+                # Customer still typing: prefix of a spice name
+                spice = rng.choice(SPICES)
+                queries.append(spice[:rng.randint(3, len(spice))])
+            elif kind < 0.9:
+                queries.append(f"{rng.choice(SPICES)} {rng.choice(WEIGHTS)}")
+            else:
+                queries.append(rng.choice(self._vocabulary))
+        return [q for q in queries if tokenize(q)]
+
+    def measure(self, queries, fn):
+        for query in queries[:20]:  # warm up caches
+            fn(query)
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            fn(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    @staticmethod
+    def percentile(timings, pct):
+        ordered = sorted(timings)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def report(self, label, timings):
+        self.stdout.write(
+            f"{label}: n={len(timings)} mean={statistics.mean(timings):.2f}ms "
+            f"p50={self.percentile(timings, 50):.2f}ms "
+            f"p95={self.percentile(timings, 95):.2f}ms "
+            f"p99={self.percentile(timings, 99):.2f}ms"
+        )
@@ -0,0 +1,103 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.benchmarks import SCENARIOS, run_benchmarks, uncovered_url_names
+from shop.models import Category, Order, Product
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every named shop URL through the test client and write "
+        "p50/p95/p99 latency, query counts and response sizes as JSON. "
+        "Seed data first with manage.py seed_shop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--cold-cache", action="store_true",
+                            help="Clear the cache before every request.")
+        parser.add_argument("--user", help="Username to run the customer scenarios as.")
+        parser.add_argument("--only", nargs="+", metavar="URL_NAME",
+                            help="Only benchmark these URL names.")
+        parser.add_argument("--output", default="benchmark.json",
+                            help="Where to write the JSON results.")
+        parser.add_argument("--compare", metavar="JSON",
+                            help="Earlier results to print the difference against.")
+
+    def handle(self, *args, **options):
+        missing = uncovered_url_names()
+        if missing:
+            self.stderr.write(self.style.WARNING(f"No benchmark scenario for: {', '.join(missing)}"))
+
+        self.stdout.write(f"{'scenario':<36} {'status':<10} {'p50':>8} {'p95':>8} {'p99':>8} "
+                          f"{'queries':>7} {'bytes':>9}")
+        try:
+            results = run_benchmarks(
+                SCENARIOS, iterations=options["iterations"], warmup=options["warmup"],
+                cold_cache=options["cold_cache"], username=options["user"],
+                only=options["only"], progress=self.print_result,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        report = {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "commit": git_commit(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "iterations": options["iterations"],
+                "warmup": options["warmup"],
+                "cold_cache": options["cold_cache"],
+                "catalog": {
+                    "categories": Category.objects.count(),
+                    "products": Product.objects.count(),
+                    "orders": Order.objects.count(),
+                },
+            },
+            "results": results,
+            "uncovered": missing,
+        }
+        with open(options["output"], "w") as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+        if options["compare"]:
+            self.compare(options["compare"], results)
+
+    def print_result(self, result):
+        status = ",".join(str(code) for code in sorted(result["status"]))
+        latency = result["latency_ms"]
+        self.stdout.write(
+            f"{result['key']:<36} {status:<10} {latency['p50']:>8.2f} {latency['p95']:>8.2f} "
+            f"{latency['p99']:>8.2f} {result['queries']['median']:>7} {result['bytes']['median']:>9}"
+        )
+
+    def compare(self, path, results):
+        with open(path) as fh:
+            before = {result["key"]: result for result in json.load(fh)["results"]}
+        self.stdout.write(f"\nCompared with {path}:")
+        for result in results:
+            old = before.get(result["key"])
+            if old is None:
+                continue
+            p95_change = result["latency_ms"]["p95"] - old["latency_ms"]["p95"]
+            query_change = result["queries"]["median"] - old["queries"]["median"]
+            line = f"{result['key']:<36} p95 {p95_change:+8.2f} ms  queries {query_change:+g}"
+            slower = p95_change > 0.2 * old["latency_ms"]["p95"] or query_change > 0
+            self.stdout.write(self.style.WARNING(line) if slower else line)
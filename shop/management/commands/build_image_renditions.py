@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.fields.json import KT
+
+from shop.images import IMAGE_MODELS, render_instance
+
+
+def _init_worker():
+    # Spawned processes start without Django; forked ones must not share the
+    # parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def _render(label, pk, force):
+    try:
+        return label, pk, render_instance(label, pk, force=force), None
+    except Exception as exc:
+        return label, pk, False, f"{type(exc).__name__}: {exc}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the responsive WebP/JPEG renditions of product, gallery and category "
+        "images that don't have up-to-date ones, in parallel processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Worker processes; 1 renders in this process.")
+        parser.add_argument("--force", action="store_true", help="Rebuild every image's renditions.")
+        parser.add_argument("--model", choices=sorted(IMAGE_MODELS), action="append",
+                            help="Only these models (repeatable).")
+
+    def handle(self, *args, **options):
+        force = options["force"]
+        tasks = []
+        for label in options["model"] or sorted(IMAGE_MODELS):
+            objects = IMAGE_MODELS[label].objects.exclude(image="").exclude(image__isnull=True)
+            if not force:
+                source = KT("image_renditions__source")
+                objects = objects.alias(source=source).filter(Q(source__isnull=True) | ~Q(source=F("image")))
+            tasks += [(label, pk) for pk in objects.order_by("pk").values_list("pk", flat=True)]
+        self.stdout.write(f"{len(tasks)} images to render.")
+
+        if options["workers"] <= 1:
+            results = (_render(label, pk, force) for label, pk in tasks)
+            self.report(results, len(tasks))
+            return
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=_init_worker) as pool:
+            futures = [pool.submit(_render, label, pk, force) for label, pk in tasks]
+            self.report((future.result() for future in as_completed(futures)), len(tasks))
+
+    def report(self, results, total):
+        rendered = failed = 0
+        for done, (label, pk, written, error) in enumerate(results, 1):
+            if error:
+                failed += 1
+                self.stderr.write(f"{label} {pk}: {error}")
+            elif written:
+                rendered += 1
+            if done % 100 == 0:
+                self.stdout.write(f"{done}/{total}")
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} images, {failed} failed."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog_cache import catalog_cache_stats, catalog_version, reset_catalog_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the catalog page cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Zero the counters afterwards.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Catalog version: {catalog_version()}")
+        for name, counts in catalog_cache_stats().items():
+            total = counts["hits"] + counts["misses"]
+            ratio = counts["hits"] / total * 100 if total else 0
+            self.stdout.write(
+                f"{name:24} hits={counts['hits']:<8} misses={counts['misses']:<8} hit ratio={ratio:.1f}%"
+            )
+        if options["reset"]:
+            reset_catalog_cache_stats()
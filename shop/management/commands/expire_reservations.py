@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from shop.reservations import EXPIRE_BATCH_SIZE, expire_reservations, rebuild_reserved
+
+
+class Command(BaseCommand):
+    help = "Release the stock held by expired checkout reservations. Runs from cron every minute (see render.yaml)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EXPIRE_BATCH_SIZE,
+                            help="Reservations released per transaction.")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Afterwards recompute every variant's reserved stock from the live reservations.")
+
+    def handle(self, *args, **options):
+        expired = expire_reservations(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Released {expired} expired reservations."))
+        if options["rebuild"]:
+            variants = rebuild_reserved()
+            self.stdout.write(self.style.SUCCESS(f"Recomputed reserved stock of {variants} variants."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog_io import export_catalog
+
+
+class Command(BaseCommand):
+    help = "Write every product with its variants and gallery images as a CSV or JSONL catalog file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", default="-", help="File to write, or - for stdout.")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="File format; by default taken from the file extension.")
+
+    def handle(self, *args, **options):
+        path = options["output"]
+        file_format = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        if path == "-":
+            # Rows carry their own line endings
+            self.stdout.ending = ""
+            export_catalog(self.stdout, file_format)
+            return
+        with open(path, "w", newline="", encoding="utf-8") as out:
+            count = export_catalog(out, file_format)
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} products to {path}."))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import BATCH_SIZE, CatalogError, import_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products, variants and gallery images from a CSV or JSONL "
+        "catalog file (see shop/catalog_io.py), streaming it in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Catalog file, or - for stdin.")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="File format; by default taken from the file extension.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Products compared and written per transaction.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Write nothing; list what would change instead.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        dry_run = options["dry_run"]
+
+        def progress(stats):
+            self.stderr.write(f"{stats.products} products, {stats.variants} variants")
+
+        try:
+            if path == "-":
+                stats = import_catalog(sys.stdin, file_format, options["batch_size"], dry_run,
+                                       report=self.stdout.write if dry_run else None, progress=progress)
+            else:
+                with open(path, newline="", encoding="utf-8") as lines:
+                    stats = import_catalog(lines, file_format, options["batch_size"], dry_run,
+                                           report=self.stdout.write if dry_run else None, progress=progress)
+        except (OSError, CatalogError) as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(("Dry run, nothing written. " if dry_run else "") + stats.summary())
+        for error in stats.errors:
+            self.stderr.write(error)
+        if stats.error_count > len(stats.errors):
+            self.stderr.write(f"... and {stats.error_count - len(stats.errors)} more")
+        if stats.error_count:
+            raise CommandError(f"{stats.error_count} rows were skipped.")
+        if not dry_run and (stats.products_created or stats.products_updated or stats.galleries_replaced):
+            self.stdout.write("Run build_image_renditions to render the images of the new and changed products.")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute the min/max price, cheapest variant and stock flag of every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Products updated per UPDATE statement.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = Product.objects.order_by("id").values_list("id", flat=True)
+        last_id = 0
+        total = 0
+        while True:
+            # Walk the catalog in primary-key ranges so each UPDATE stays short
+            batch = list(ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                total += Product.objects.filter(id__gte=batch[0], id__lte=batch[-1]).refresh_price_summary()
+            last_id = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {total} products."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold new orders into the co-purchase counts and rebuild the related "
+        "products of everything they touched. Meant to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true",
+                            help="Recount every order and rebuild every product.")
+
+    def handle(self, *args, **options):
+        orders, products = refresh_recommendations(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {orders} new orders, rebuilt related products for {products} products."
+        ))
@@ -0,0 +1,46 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.jobs import BATCH_SIZE, LOCK_TIMEOUT, requeue_stale, run_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (emails, post-order work). Keep one or more "
+        "running next to gunicorn; SIGTERM stops after the current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Jobs claimed at a time.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due instead of waiting.")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed = 0
+        last_requeue = 0
+        while not self.stopping:
+            if time.monotonic() - last_requeue > LOCK_TIMEOUT.total_seconds() / 2:
+                requeued = requeue_stale()
+                if requeued:
+                    self.stderr.write(f"Requeued {requeued} jobs of dead workers.")
+                last_requeue = time.monotonic()
+
+            claimed = run_batch(worker, options["batch_size"])
+            processed += claimed
+            if not claimed:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Ran {processed} jobs."))
+
+    def stop(self, signum, frame):
+        self.stopping = True
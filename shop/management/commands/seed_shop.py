@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Product
+from shop.synthetic import DEFAULT_PASSWORD, seed_shop
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed the database with a synthetic catalog, customers, carts and "
+        "order history for benchmarking. Never run this against production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--categories", type=int, default=12)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--orders", type=int, default=2000)
+        parser.add_argument("--prefix", default="synthetic",
+                            help="Prefix of every seeded slug, username and order number.")
+        parser.add_argument("--password", default=DEFAULT_PASSWORD,
+                            help="Password of every seeded user.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if (Product.objects.filter(slug__startswith=f"{prefix}-").exists()
+                or User.objects.filter(username__startswith=f"{prefix}-user-").exists()):
+            raise CommandError(f"Data with prefix '{prefix}' already exists; pick another --prefix.")
+
+        started = time.perf_counter()
+        counts = seed_shop(
+            products=options["products"], categories=options["categories"],
+            users=options["users"], orders=options["orders"], prefix=prefix,
+            seed=options["seed"], password=options["password"],
+        )
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {summary} in {time.perf_counter() - started:.1f}s"
+        ))
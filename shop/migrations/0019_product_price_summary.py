@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+
+
+def fill_price_summary(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductVariant = apps.get_model('shop', 'ProductVariant')
+    variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by()
+    Product.objects.update(
+        min_price=Subquery(variants.values('product').annotate(p=Min('price')).values('p')),
+        max_price=Subquery(variants.values('product').annotate(p=Max('price')).values('p')),
+        cheapest_variant=Subquery(variants.order_by('price', 'id').values('id')[:1]),
+        in_stock=Exists(variants.filter(stock__gt=0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cheapest_variant',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.productvariant'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='in_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(fill_price_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:59
+
+from django.db import migrations, models
+
+# Roles used to be encoded in alt_text by convention. A frozen copy of
+# ProductImage.LEGACY_ROLES: migrations must not import app code, which can
+# change after this migration has run.
+LEGACY_ROLES = {
+    'Main_Image': 'main',
+    'Side_1': 'side_1',
+    'Side_2': 'side_2',
+}
+
+
+def roles_from_alt_text(apps, schema_editor):
+    ProductImage = apps.get_model('shop', 'ProductImage')
+    for alt_text, role in LEGACY_ROLES.items():
+        ProductImage.objects.filter(alt_text=alt_text).update(role=role)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_product_price_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='role',
+            field=models.CharField(choices=[('main', 'Main image'), ('side_1', 'Side image 1'), ('side_2', 'Side image 2'), ('gallery', 'Gallery')], default='gallery', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'role'], name='shop_productimage_role_idx'),
+        ),
+        migrations.RunPython(roles_from_alt_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:11
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Racing add_to_cart requests could create several rows for one variant
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('user_id', 'variant_id')
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for line in duplicates:
+        CartItem.objects.filter(id=line['keep']).update(quantity=line['total'])
+        CartItem.objects.filter(user_id=line['user_id'], variant_id=line['variant_id']).exclude(
+            id=line['keep']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'variant'), name='shop_cartitem_user_variant_uniq'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:16
+
+import secrets
+
+from django.db import migrations, models
+
+
+def create_state(apps, schema_editor):
+    # The key must never change once order numbers have been issued with it
+    OrderNumberState = apps.get_model('shop', 'OrderNumberState')
+    Order = apps.get_model('shop', 'Order')
+    OrderNumberState.objects.create(
+        pk=1, key=secrets.token_hex(32), check_legacy=Order.objects.exists(),
+    )
+
+
+def create_sequence(apps, schema_editor):
+    # Blocks of 100 (order_numbers.BLOCK_SIZE) per nextval
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE SEQUENCE IF NOT EXISTS shop_order_number_seq INCREMENT BY 100 MINVALUE 0 START WITH 0"
+        )
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP SEQUENCE IF EXISTS shop_order_number_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_cartitem_user_variant_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('next_value', models.BigIntegerField(default=0)),
+                ('check_legacy', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(create_state, migrations.RunPython.noop),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0027_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='shop_order_created_idx'),
+        ),
+        # The order admin's customer search matches LOWER(email) exactly. The
+        # user table belongs to django.contrib.auth, hence the raw SQL
+        migrations.RunSQL(
+            'CREATE INDEX shop_auth_user_email_lower_idx ON auth_user (LOWER(email))',
+            'DROP INDEX shop_auth_user_email_lower_idx',
+        ),
+    ]
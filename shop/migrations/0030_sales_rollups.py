@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0029_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_status', models.CharField(max_length=20)),
+                ('cancelled', models.BooleanField(default=False)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_status', 'cancelled'), name='shop_dailysales_key_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyVariantSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('variant_id', models.BigIntegerField()),
+                ('product_id', models.BigIntegerField()),
+                ('category_id', models.BigIntegerField()),
+                ('payment_status', models.CharField(max_length=20)),
+                ('cancelled', models.BooleanField(default=False)),
+                ('lines', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily variant sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'variant_id', 'payment_status', 'cancelled'), name='shop_dailyvariantsales_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:53
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    ProductVariant = apps.get_model('shop', 'ProductVariant')
+    variant = ProductVariant.objects.filter(id=OuterRef('variant_id'))
+    # Lines whose variant is already gone keep blank snapshots
+    OrderItem.objects.filter(variant__isnull=False).update(
+        product_name=Subquery(variant.values('product__name')[:1]),
+        product_slug=Subquery(variant.values('product__slug')[:1]),
+        weight=Subquery(variant.values('weight')[:1]),
+        image=Subquery(variant.values('product__image')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0030_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='image',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_slug',
+            field=models.SlugField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='weight',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.RunPython(fill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0031_orderitem_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationstate',
+            name='last_product_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 21:23
+
+import time
+
+from django.db import migrations, models
+
+
+def create_state(apps, schema_editor):
+    # The version used to live in the cache; starting from the clock keeps it
+    # ahead of any version the cache entries were written under
+    CatalogState = apps.get_model('shop', 'CatalogState')
+    CatalogState.objects.get_or_create(pk=1, defaults={'version': time.time_ns()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0032_recommendationstate_last_product_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_state, migrations.RunPython.noop),
+    ]
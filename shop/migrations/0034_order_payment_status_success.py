@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def completed_to_success(apps, schema_editor):
+    # Paid orders used to be saved as 'Completed', which isn't one of
+    # PAYMENT_STATUS_CHOICES; place_order() saves them as 'Success'
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.filter(payment_status='Completed').update(payment_status='Success')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0033_catalogstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(completed_to_success, migrations.RunPython.noop),
+    ]
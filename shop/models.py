@@ -1,10 +1,35 @@
 from django.db import models
+from django.db.models import Case, Exists, F, Max, Min, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.contrib.auth.models import User
+from .catalog_cache import bump_catalog_version
+
+# Resized WebP/JPEG copies of an image field, written by shop/images.py:
+# {'source': name, 'width': w, 'height': h, 'renditions': [{'width', 'height', 'format', 'name'}]}
+RENDITIONS_FIELD = 'image_renditions'
+
+
+def _update_fields_without(instance, kwargs, owned):
+    # Columns maintained elsewhere with queryset updates; saving an instance
+    # must never write back a copy that may have gone stale since it was loaded
+    if not instance._state.adding and kwargs.get('update_fields') is None:
+        kwargs['update_fields'] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in owned
+        ]
+    return kwargs
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     image = models.ImageField(upload_to='category_images/', blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **_update_fields_without(self, kwargs, (RENDITIONS_FIELD,)))
 
     def __str__(self):
         return self.name
@@ -12,43 +37,232 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = "Categories"
 
+PRICE_SUMMARY_FIELDS = ('min_price', 'max_price', 'cheapest_variant', 'in_stock')
+PRICE_SUMMARY_BATCH_SIZE = 1000
+
+
+class ProductQuerySet(models.QuerySet):
+    def refresh_price_summary(self):
+        """Recompute the denormalized variant summary columns in one UPDATE."""
+        variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by()
+        return self.update(
+            min_price=Subquery(variants.values('product').annotate(p=Min('price')).values('p')),
+            max_price=Subquery(variants.values('product').annotate(p=Max('price')).values('p')),
+            cheapest_variant=Subquery(variants.order_by('price', 'id').values('id')[:1]),
+            in_stock=Exists(variants.filter(stock__gt=0)),
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     description = models.TextField()
     image = models.ImageField(upload_to='products/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Summary of the variants, maintained by ProductVariantQuerySet and the
+    # variant signals so listings never need to touch the variant table.
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    cheapest_variant = models.ForeignKey(
+        'ProductVariant', on_delete=models.SET_NULL, null=True, blank=True,
+        editable=False, related_name='+'
+    )
+    in_stock = models.BooleanField(default=False, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        # The summary columns are owned by the variants
+        super().save(*args, **_update_fields_without(self, kwargs, PRICE_SUMMARY_FIELDS + (RENDITIONS_FIELD,)))
+
+    @cached_property
+    def image_map(self):
+        """
+        Role -> URL map of the product gallery, e.g. {'main': url, 'side_1': url,
+        'gallery': [url, ...]}. Built from ``self.images.all()``, so it costs no
+        query when the images were loaded with ``prefetch_related('images')``.
+        """
+        image_map = {ProductImage.ROLE_GALLERY: []}
+        for product_image in self.images.all():
+            url = product_image.image.url
+            if product_image.role == ProductImage.ROLE_GALLERY:
+                image_map[ProductImage.ROLE_GALLERY].append(url)
+            else:
+                image_map.setdefault(product_image.role, url)
+        return image_map
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # Category listing, keyset-paginated newest first
+            models.Index(fields=['category', '-created_at', '-id'], name='shop_product_cat_created_idx'),
+        ]
+
+class ProductVariantQuerySet(models.QuerySet):
+    # Queryset writes skip the post_save/post_delete signals, so they refresh
+    # the summary columns of every product they touched and invalidate the
+    # catalog cache themselves.
+
+    def _refresh_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            bump_catalog_version()
+        for start in range(0, len(product_ids), PRICE_SUMMARY_BATCH_SIZE):
+            batch = product_ids[start:start + PRICE_SUMMARY_BATCH_SIZE]
+            Product.objects.filter(id__in=batch).refresh_price_summary()
+
+    def update(self, **kwargs):
+        product_ids = set(self.values_list('product_id', flat=True))
+        rows = super().update(**kwargs)
+        new_product = kwargs.get('product_id', kwargs.get('product'))
+        if new_product is not None:
+            product_ids.add(getattr(new_product, 'pk', new_product))
+        self._refresh_products(product_ids)
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        product_ids = set(self.values_list('product_id', flat=True))
+        result = super().delete()
+        self._refresh_products(product_ids)
+        return result
+
+    delete.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        self._refresh_products({variant.product_id for variant in created})
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        self._refresh_products({variant.product_id for variant in objs})
+        return rows
+
+    def decrement_stock(self, quantities, held=None):
+        """
+        Take ``{variant_id: quantity}`` out of stock with one UPDATE that only
+        matches variants with enough unreserved stock, so concurrent orders can
+        never oversell. ``held`` is the caller's own ``{variant_id: quantity}``
+        reservations, which are released by the same UPDATE and count as
+        available to it. Returns the number of variants updated; fewer than
+        ``len(quantities)`` means the caller must roll back.
+        """
+        needed = _per_variant(quantities)
+        released = _per_variant({variant_id: (held or {}).get(variant_id, 0) for variant_id in quantities})
+        rows = models.QuerySet.update(
+            self.filter(id__in=quantities, stock__gte=F('reserved') - released + needed),
+            stock=F('stock') - needed,
+            reserved=F('reserved') - released,
+        )
+        # Only a variant that sold out changes its product's summary
+        sold_out = self.filter(id__in=quantities, stock=0).values_list('product_id', flat=True)
+        self._refresh_products(set(sold_out))
+        return rows
+
+    decrement_stock.alters_data = True
+
+    # Reservations don't change the product summaries: in_stock is about the
+    # stock on the shelf, holds only hide it from other checkouts for a while.
+
+    def adjust_reserved(self, deltas):
+        """
+        Add ``{variant_id: delta}`` to the reserved stock with one UPDATE.
+        Increases only apply where that much stock is unreserved; returns the
+        number of variants updated, fewer than ``len(deltas)`` means the
+        caller must roll back. Releases never take reserved below zero.
+        """
+        delta = _per_variant(deltas)
+        growing = [variant_id for variant_id, change in deltas.items() if change > 0]
+        return models.QuerySet.update(
+            self.filter(id__in=deltas).filter(~Q(id__in=growing) | Q(stock__gte=F('reserved') + delta)),
+            reserved=Greatest(F('reserved') + delta, Value(0)),
+        )
+
+    adjust_reserved.alters_data = True
+
+
+def _per_variant(values):
+    return Case(
+        *[When(id=variant_id, then=Value(value)) for variant_id, value in values.items()],
+        default=Value(0),
+        output_field=models.IntegerField(),
+    )
+
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
     weight = models.CharField(max_length=50)  # e.g., "100g", "250g", "1kg"
     old_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
+    # Sum of the live StockReservations, kept in step by shop/reservations.py
+    # so availability is read from this row alone
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductVariantQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # reserved is owned by the checkouts holding stock
+        super().save(*args, **_update_fields_without(self, kwargs, ('reserved',)))
+
+    @property
+    def available(self):
+        return max(self.stock - self.reserved, 0)
 
     def __str__(self):
         return f"{self.product.name} - {self.weight}"
 
     class Meta:
         unique_together = ('product', 'weight')
+        indexes = [
+            # A product's variants cheapest first: the price summary and the product page
+            models.Index(fields=['product', 'price', 'id'], name='shop_variant_product_price_idx'),
+        ]
 
 class ProductImage(models.Model):
+    ROLE_MAIN = 'main'
+    ROLE_SIDE_1 = 'side_1'
+    ROLE_SIDE_2 = 'side_2'
+    ROLE_GALLERY = 'gallery'
+    ROLE_CHOICES = [
+        (ROLE_MAIN, 'Main image'),
+        (ROLE_SIDE_1, 'Side image 1'),
+        (ROLE_SIDE_2, 'Side image 2'),
+        (ROLE_GALLERY, 'Gallery'),
+    ]
+    # Roles used to be encoded in alt_text; the old labels still resolve
+    LEGACY_ROLES = {
+        'Main_Image': ROLE_MAIN,
+        'Side_1': ROLE_SIDE_1,
+        'Side_2': ROLE_SIDE_2,
+    }
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='product_gallery/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=100, blank=True)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ROLE_GALLERY)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **_update_fields_without(self, kwargs, (RENDITIONS_FIELD,)))
 
     def __str__(self):
         return self.alt_text or f"Extra image for {self.product.name}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'role'], name='shop_productimage_role_idx'),
+        ]
+
 class CustomerProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     phone = models.CharField(max_length=15)
@@ -73,6 +287,12 @@ class Address(models.Model):
     def __str__(self):
         return f"{self.flat}, {self.city}"
 
+    class Meta:
+        indexes = [
+            # A customer's selected address, and unselecting it
+            models.Index(fields=['user', 'is_selected'], name='shop_address_user_selected_idx'),
+        ]
+
 
 from django.views.decorators.csrf import csrf_exempt
 from .models import CustomerProfile, Address
@@ -164,6 +384,12 @@ class CartItem(models.Model):
     def total_price(self):
         return self.variant.price * self.quantity
 
+    class Meta:
+        constraints = [
+            # One row per variant; quantities are added up with an upsert
+            models.UniqueConstraint(fields=['user', 'variant'], name='shop_cartitem_user_variant_uniq'),
+        ]
+
 @login_required
 def checkout(request):
     user = request.user
@@ -203,7 +429,38 @@ def checkout(request):
     context = {'addresses': addresses}
     return render(request, 'checkout.html', context)
 
-import uuid
+class StockReservation(models.Model):
+    """A checkout's hold on variant stock, counted in ProductVariant.reserved until it expires."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username} holds {self.quantity} x {self.variant}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'variant'], name='shop_stockreservation_user_variant_uniq'),
+        ]
+        indexes = [
+            # The sweeper's scan for expired holds
+            models.Index(fields=['expires_at'], name='shop_stockres_expires_idx'),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Orders with their address and lines, in two queries however many
+        orders there are. The lines carry their own snapshot of the product,
+        so rendering them never touches the catalog.
+        """
+        return self.select_related('address').prefetch_related(
+            models.Prefetch('items', queryset=OrderItem.objects.order_by('id'))
+        )
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -228,19 +485,26 @@ class Order(models.Model):
 
     order_number = models.CharField(max_length=8, unique=True, editable=False)
 
+    objects = OrderQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # generate a unique 8-digit number
-            while True:
-                num = str(uuid.uuid4().int)[:8]
-                if not Order.objects.filter(order_number=num).exists():
-                    self.order_number = num
-                    break
+            # Unique 8-digit number without looking at the order table
+            from .order_numbers import next_order_number
+            self.order_number = next_order_number()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+    class Meta:
+        indexes = [
+            # My Orders, keyset-paginated newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='shop_order_user_created_idx'),
+            # The admin's changelist and its date hierarchy
+            models.Index(fields=['-created_at', '-id'], name='shop_order_created_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
@@ -248,8 +512,32 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)  # store price at order time
 
+    # What the customer bought, as it was at order time. Order history reads
+    # these, so it renders the same after the variant is edited or deleted.
+    product_name = models.CharField(max_length=200, blank=True, editable=False)
+    product_slug = models.SlugField(blank=True, editable=False)
+    weight = models.CharField(max_length=50, blank=True, editable=False)
+    image = models.ImageField(upload_to='products/', blank=True, editable=False)
+
+    def snapshot_variant(self):
+        """Copy the product details of ``self.variant`` onto the line."""
+        product = self.variant.product
+        self.product_name = product.name
+        self.product_slug = product.slug
+        self.weight = self.variant.weight
+        self.image = product.image.name
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.variant_id and not self.product_name:
+            self.snapshot_variant()
+        super().save(*args, **kwargs)
+
+    @property
+    def line_total(self):
+        return self.price * self.quantity
+
     def __str__(self):
-        return f"{self.variant.product.name} - {self.variant.weight} (x{self.quantity})"
+        return f"{self.product_name} - {self.weight} (x{self.quantity})"
 
 class HomePageFeatured(models.Model):
     title = models.CharField(max_length=100, default="Featured Products")
@@ -258,3 +546,181 @@ class HomePageFeatured(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class SearchTerm(models.Model):
+    """Distinct tokens of the search index, used to expand query prefixes."""
+    token = models.CharField(max_length=40, unique=True)
+
+    def __str__(self):
+        return self.token
+
+
+class SearchToken(models.Model):
+    """One row of the product search inverted index (token -> product)."""
+    token = models.CharField(max_length=40)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    weight = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.token} -> {self.product_id}"
+
+    class Meta:
+        unique_together = ('token', 'product')
+        indexes = [
+            # Covers every search query: postings of a token, best first
+            models.Index(fields=['token', '-weight', 'product'], name='shop_search_token_rank_idx'),
+        ]
+
+
+class CoPurchase(models.Model):
+    """Number of orders containing both products, stored in both directions."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.count}"
+
+    class Meta:
+        unique_together = ('product', 'other')
+
+
+class RelatedProduct(models.Model):
+    """Precomputed top-K "customers also bought" neighbours of a product."""
+    SOURCE_CO_PURCHASE = 'co_purchase'
+    SOURCE_CATEGORY = 'category'
+    SOURCE_CHOICES = [
+        (SOURCE_CO_PURCHASE, 'Bought together'),
+        (SOURCE_CATEGORY, 'Same category'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField(default=0)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=SOURCE_CO_PURCHASE)
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+    class Meta:
+        # (product, rank) doubles as the index the product page reads
+        unique_together = ('product', 'rank')
+        ordering = ['rank']
+
+
+class RecommendationState(models.Model):
+    """Single row remembering how far refresh_recommendations has read orders and products."""
+    last_order_id = models.BigIntegerField(default=0)
+    # Products up to this id have had their neighbours built at least once
+    last_product_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations up to order {self.last_order_id}"
+
+
+class CatalogState(models.Model):
+    """Single row holding the catalog version of shop/catalog_cache.py, shared by every process."""
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+
+class OrderNumberState(models.Model):
+    """Single row holding the key and counter of shop/order_numbers.py."""
+    key = models.CharField(max_length=64)
+    next_value = models.BigIntegerField(default=0)
+    # Orders from the old random generator exist, so new numbers are checked
+    check_legacy = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Order numbers up to {self.next_value}"
+
+
+class Job(models.Model):
+    """A unit of background work, run by `manage.py run_jobs` (see shop/jobs.py)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=100)  # lower runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # At most one queued job per key, for work that only needs to run once
+    key = models.CharField(max_length=200, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=Q(status='queued'), name='shop_job_queued_key_uniq'),
+        ]
+        indexes = [
+            # The worker's dequeue scan, which only looks at queued jobs
+            models.Index(fields=['priority', 'run_at', 'id'], condition=Q(status='queued'), name='shop_job_dequeue_idx'),
+            models.Index(fields=['status', 'locked_at'], name='shop_job_status_locked_idx'),
+        ]
+
+
+# Sales rollups, kept up to date by shop/analytics.py. Rows are only ever
+# incremented, so they carry plain ids rather than foreign keys: deleting a
+# product must not delete its sales history.
+
+class DailySales(models.Model):
+    """Orders and their totals (delivery included) per day and payment outcome."""
+    day = models.DateField()
+    payment_status = models.CharField(max_length=20)
+    cancelled = models.BooleanField(default=False)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} {self.payment_status}: {self.orders} orders"
+
+    class Meta:
+        verbose_name_plural = "Daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payment_status', 'cancelled'], name='shop_dailysales_key_uniq'),
+        ]
+
+
+class DailyVariantSales(models.Model):
+    """Units sold and item revenue per day, variant and payment outcome."""
+    day = models.DateField()
+    variant_id = models.BigIntegerField()
+    # The variant's product and category when it was sold
+    product_id = models.BigIntegerField()
+    category_id = models.BigIntegerField()
+    payment_status = models.CharField(max_length=20)
+    cancelled = models.BooleanField(default=False)
+    lines = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} variant {self.variant_id}: {self.quantity} sold"
+
+    class Meta:
+        verbose_name_plural = "Daily variant sales"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'variant_id', 'payment_status', 'cancelled'], name='shop_dailyvariantsales_key_uniq',
+            ),
+        ]
@@ -0,0 +1,127 @@
+"""
+Order numbers.
+
+The n-th order gets permute(n): an 8-digit number from a Feistel network
+over [0, 10**8) whose round function is an HMAC with a secret key. Distinct
+counter values always give distinct numbers, so no lookup is needed to
+avoid duplicates, and without the key consecutive orders look random.
+
+On PostgreSQL the counter is the shop_order_number_seq sequence, which
+hands out blocks of BLOCK_SIZE values, so a process only talks to the
+database once per block. Sequences never roll back, so a block is never
+handed out twice. Other databases take one value at a time from
+OrderNumberState with an UPDATE ... RETURNING inside the order's own
+transaction.
+
+The key lives in OrderNumberState and must never change. Databases that
+already held orders from the old random generator have check_legacy set.
+There each block is checked once against the existing numbers, and values
+that clash are skipped.
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+
+from django.db import connection
+
+from .models import Order, OrderNumberState
+
+DIGITS = 8
+DOMAIN = 10 ** DIGITS
+HALF = 10 ** (DIGITS // 2)
+ROUNDS = 8
+BLOCK_SIZE = 100  # must match INCREMENT BY of shop_order_number_seq
+SEQUENCE = 'shop_order_number_seq'
+
+
+class OrderNumbersExhausted(Exception):
+    pass
+
+
+def _round(key, round_number, value):
+    digest = hmac.new(key, f"{round_number}:{value}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big') % HALF
+
+
+def permute(value, key):
+    """Keyed bijection of [0, DOMAIN) onto itself."""
+    left, right = divmod(value, HALF)
+    for round_number in range(ROUNDS):
+        left, right = right, (left + _round(key, round_number, right)) % HALF
+    return left * HALF + right
+
+
+def format_number(value, key):
+    return f"{permute(value, key):0{DIGITS}d}"
+
+
+def _state():
+    state = OrderNumberState.objects.filter(pk=1).first()
+    if state is None:
+        # Normally created by migration 0024; recreated after a table flush
+        state, _ = OrderNumberState.objects.get_or_create(
+            pk=1, defaults={'key': secrets.token_hex(32), 'check_legacy': Order.objects.exists()},
+        )
+    return state
+
+
+class _Allocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._numbers = []
+        self._key = None
+
+    def _reserve_values(self):
+        """Return (key, check_legacy, range of counter values)."""
+        if self._key is None:
+            state = _state()
+            self._key = (state.key.encode(), state.check_legacy)
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT nextval(%s)", [SEQUENCE])
+                start = cursor.fetchone()[0]
+                return (*self._key, range(start, start + BLOCK_SIZE))
+
+            # One value at a time, taken in the caller's transaction so that a
+            # rollback returns it. UPDATE ... RETURNING is atomic on its own.
+            table = connection.ops.quote_name(OrderNumberState._meta.db_table)
+            sql = f"UPDATE {table} SET next_value = next_value + 1 WHERE id = 1 RETURNING next_value"
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            if row is None:
+                _state()
+                cursor.execute(sql)
+                row = cursor.fetchone()
+            start = row[0] - 1
+        return (*self._key, range(start, start + 1))
+
+    def _reserve(self):
+        key, check_legacy, values = self._reserve_values()
+        if values.stop > DOMAIN:
+            raise OrderNumbersExhausted(f"All {DOMAIN} order numbers have been used")
+        numbers = [format_number(value, key) for value in values]
+        if check_legacy:
+            taken = set(Order.objects.filter(order_number__in=numbers).values_list('order_number', flat=True))
+            numbers = [number for number in numbers if number not in taken]
+        return numbers
+
+    def next(self):
+        with self._lock:
+            while not self._numbers:
+                self._numbers = self._reserve()
+            return self._numbers.pop(0)
+
+    def reset(self):
+        """Forget the cached key and any unused numbers."""
+        with self._lock:
+            self._numbers = []
+            self._key = None
+
+
+_allocator = _Allocator()
+
+
+def next_order_number():
+    return _allocator.next()
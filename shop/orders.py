@@ -0,0 +1,127 @@
+"""
+Order placement.
+
+place_order() turns a customer's cart into an Order in one transaction with
+a fixed number of statements whatever the size of the cart: read the cart,
+insert the order, take the stock with one conditional UPDATE, insert every
+OrderItem with one INSERT and delete the cart lines. The customer's checkout
+holds (shop/reservations.py) are released by the same UPDATE that takes the
+stock, so stock they held is theirs. If any variant lacks the stock, nothing
+is written and the holds stay.
+
+The sales rollups (shop/analytics.py) are updated in the same transaction.
+The confirmation email and the recommendations refresh are queued as
+background jobs in the same transaction (shop/jobs.py), so they only happen
+for orders that commit and never slow down the checkout.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+
+from .analytics import record_items
+from .cart import cart_changed
+from .emails import queue_order_confirmation
+from .jobs import PRIORITY_LOW, enqueue
+from .models import CartItem, Order, OrderItem, ProductVariant
+from .recommendations import SETTLE_DELAY
+from .reservations import expire_reservations, release_holds, take_holds
+
+FREE_DELIVERY_FROM = 500
+DELIVERY_FEE = 50
+
+
+class OrderError(Exception):
+    pass
+
+
+class EmptyCart(OrderError):
+    pass
+
+
+class OutOfStock(OrderError):
+    def __init__(self, variants):
+        self.variants = variants
+        names = ", ".join(str(variant) for variant in variants)
+        super().__init__(f"Not enough stock for {names}")
+
+
+class _Oversold(Exception):
+    pass
+
+
+def _take_stock(quantities, held):
+    # In a savepoint, so a partial decrement is undone before the caller
+    # reads the stock levels back for its error message
+    try:
+        with transaction.atomic():
+            if ProductVariant.objects.decrement_stock(quantities, held=held) < len(quantities):
+                raise _Oversold
+    except _Oversold:
+        return False
+    return True
+
+
+def delivery_fee(subtotal):
+    return DELIVERY_FEE if subtotal < FREE_DELIVERY_FROM else 0
+
+
+def place_order(user, address, paid):
+    """
+    Place an order for everything in ``user``'s cart. A failed payment
+    (``paid`` false) is recorded as a cancelled order and takes no stock.
+    Raises EmptyCart or OutOfStock.
+    """
+    with transaction.atomic():
+        lines = list(
+            CartItem.objects.select_for_update(of=('self',))
+            .filter(user=user)
+            .select_related('variant__product')
+        )
+        if not lines:
+            raise EmptyCart("Your cart is empty.")
+
+        subtotal = sum(line.variant.price * line.quantity for line in lines)
+        order = Order.objects.create(
+            user=user,
+            address=address,
+            total_price=subtotal + delivery_fee(subtotal),
+            payment_status="Success" if paid else "Failed",
+            status="Pending" if paid else "Cancelled",
+        )
+
+        held = take_holds(user)
+        if paid:
+            quantities = {line.variant_id: line.quantity for line in lines}
+            # Expired holds of other customers give way before the order does
+            if not _take_stock(quantities, held) and not (
+                expire_reservations(variant_ids=quantities) and _take_stock(quantities, held)
+            ):
+                variants = ProductVariant.objects.in_bulk(quantities)
+                raise OutOfStock([
+                    line.variant for line in lines
+                    if line.variant_id not in variants
+                    or variants[line.variant_id].available + held.get(line.variant_id, 0) < line.quantity
+                ])
+            # Holds on lines removed from the cart since the checkout page
+            release_holds({variant_id: qty for variant_id, qty in held.items() if variant_id not in quantities})
+        else:
+            release_holds(held)
+
+        items = [
+            OrderItem(order=order, variant=line.variant, quantity=line.quantity, price=line.variant.price)
+            for line in lines
+        ]
+        for item in items:
+            item.snapshot_variant()
+        OrderItem.objects.bulk_create(items)
+        record_items(order, items)
+        CartItem.objects.filter(id__in=[line.id for line in lines]).delete()
+        cart_changed(user.id)
+
+        if paid:
+            queue_order_confirmation(order)
+            # One refresh for all the orders of the next few minutes, once
+            # they are old enough for refresh_recommendations to read
+            enqueue('refresh_recommendations', priority=PRIORITY_LOW,
+                    delay=SETTLE_DELAY + timedelta(minutes=1), key='refresh_recommendations')
+    return order
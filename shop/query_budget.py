@@ -0,0 +1,181 @@
+"""
+Per-request SQL accounting: query budgets and N+1 detection.
+
+QueryRecorder wraps every database connection and records each query's SQL
+shape, duration and the line of project code that triggered it. A request
+has a problem when it runs more queries than its URL name's budget, or when
+the same query shape runs N_PLUS_ONE_THRESHOLD or more times from the same
+call site - the signature of a query inside a loop.
+
+QueryBudgetMiddleware applies this to live requests. With
+QUERY_BUDGET_STRICT on (the test suite) a problem raises
+QueryBudgetExceeded, which fails the test that made the request. Otherwise
+only a QUERY_BUDGET_SAMPLE_RATE fraction of requests is recorded and
+problems are logged to the "shop.queries" logger.
+"""
+import logging
+import random
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('shop.queries')
+
+N_PLUS_ONE_THRESHOLD = 5
+DEFAULT_BUDGET = 20
+
+# Maximum queries per request by URL name, counting session and user lookups
+# and, for customers, the cart badge
+QUERY_BUDGETS = {
+    'home': 5,
+    'category_list': 5,
+    'category_detail': 6,
+    'category_products_json': 5,
+    'product_detail': 9,
+    'search': 8,
+    'cart': 6,
+    'checkout': 12,  # includes placing the stock holds and counting the cart
+    'profile': 7,
+    'my_orders': 5,
+    'my_orders_json': 5,
+    'order_details': 5,
+    # Cached per catalog version; a 304 only reads the version
+    'api_categories': 2,
+    'api_category_products': 5,
+    'api_product': 4,
+}
+
+_PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+_IGNORED_PATHS = ('site-packages', 'dist-packages', __file__)
+_IN_LIST_RE = re.compile(r"IN \((?:%s, )*%s\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class RecordedQuery:
+    sql: str
+    duration_ms: float
+    fingerprint: str
+    call_site: str
+
+
+def fingerprint(sql):
+    """The shape of a query: IN lists of any length collapse to one form."""
+    return _WHITESPACE_RE.sub(' ', _IN_LIST_RE.sub('IN (...)', sql)).strip()
+
+
+def call_site():
+    """``file:line`` of the innermost project frame that issued the query."""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(_PROJECT_ROOT) and not frame.filename.endswith(_IGNORED_PATHS):
+            return f"{Path(frame.filename).relative_to(_PROJECT_ROOT)}:{frame.lineno}"
+    return 'unknown'
+
+
+class QueryRecorder:
+    """Record every query run on any database connection while active."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(RecordedQuery(
+                sql=sql,
+                duration_ms=(time.perf_counter() - started) * 1000,
+                fingerprint=fingerprint(sql),
+                call_site=call_site(),
+            ))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration_ms(self):
+        return sum(query.duration_ms for query in self.queries)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """[(call_site, fingerprint, times)] for query shapes run in a loop."""
+        shapes = Counter((query.call_site, query.fingerprint) for query in self.queries)
+        return [(site, shape, times) for (site, shape), times in shapes.items() if times >= threshold]
+
+    def problems(self, url_name=None, budget=None):
+        if budget is None:
+            budget = budget_for(url_name)
+        problems = []
+        if self.count > budget:
+            problems.append(f"{self.count} queries, budget for {url_name or 'this block'} is {budget}")
+        for site, shape, times in self.repeated():
+            problems.append(f"N+1: {times}x at {site}: {shape[:200]}")
+        return problems
+
+
+def budget_for(url_name):
+    budgets = {**QUERY_BUDGETS, **getattr(settings, 'QUERY_BUDGETS', {})}
+    return budgets.get(url_name, DEFAULT_BUDGET)
+
+
+@contextmanager
+def query_budget(url_name=None, budget=None):
+    """
+    Test helper: fail if the block exceeds the budget of ``url_name`` (or an
+    explicit ``budget``) or runs any query in a loop.
+
+        with query_budget('cart'):
+            self.client.get(reverse('cart'))
+    """
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.problems(url_name, budget)
+    if problems:
+        raise AssertionError("Query budget exceeded:\n" + "\n".join(problems))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        sample_rate = getattr(settings, 'QUERY_BUDGET_SAMPLE_RATE', 0)
+        if not strict and random.random() >= sample_rate:
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        problems = recorder.problems(url_name)
+        if problems and strict:
+            raise QueryBudgetExceeded(f"{request.path}: " + "; ".join(problems))
+        if problems:
+            logger.warning("%s %s: %s", request.method, request.path, "; ".join(problems))
+        else:
+            logger.debug("%s %s: %d queries in %.1f ms", request.method, request.path,
+                         recorder.count, recorder.duration_ms)
+        return response
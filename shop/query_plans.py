@@ -0,0 +1,110 @@
+"""
+Query-plan checks for the benchmark scenarios in shop/benchmarks.py.
+
+find_sequential_scans() drives every scenario once, records the SELECT,
+UPDATE and DELETE statements it runs and asks the database for the plan
+of each. It reports every statement that reads a whole table instead of
+going through an index, except the tables in SMALL_TABLES, which stay a
+few pages long however big the shop gets.
+
+A seeded test database is tiny, and on tiny tables PostgreSQL prefers a
+sequential scan even where an index would serve. Sequential scans are
+therefore switched off while planning: one still in the plan means no
+index fits the query. SQLite has no cost-based choice to switch off; it
+uses any usable index and shows ``SCAN <table>`` only where there is none.
+"""
+import re
+
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .benchmarks import SCENARIOS, load_fixtures
+
+# Read whole, and never big enough for that to matter
+SMALL_TABLES = {
+    'shop_category',
+    'shop_homepagefeatured',
+    'django_content_type',
+}
+
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def _walk(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from _walk(child)
+
+
+def sequential_scans(connection, sql, params=None):
+    """Return the tables that ``sql`` would read without an index."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            details = [row[-1] for row in cursor.fetchall()]
+            scanned = {match.group(1) for match in map(SQLITE_SCAN_RE.match, details) if match}
+            # Subqueries in FROM are scanned by name too, but cost nothing extra
+            return scanned & set(connection.introspection.table_names(cursor))
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(using=connection.alias):
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            return {node['Relation Name'] for node in _walk(plan[0]['Plan']) if node['Node Type'] == 'Seq Scan'}
+    raise NotImplementedError(f"No plan check for {connection.vendor}")
+
+
+class _StatementRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def scenario_statements(scenario, fixtures):
+    """Run ``scenario`` once and return the (sql, params) it executed on the default database."""
+    client = Client(raise_request_exception=False)
+    if scenario.login:
+        client.force_login(fixtures.user)
+    if scenario.before:
+        scenario.before(client, fixtures)
+    url = reverse(scenario.name, kwargs=scenario.kwargs(fixtures) if scenario.kwargs else None)
+    data = scenario.data(fixtures) if scenario.data else None
+    headers = scenario.headers(fixtures) if scenario.headers else None
+
+    recorder = _StatementRecorder()
+    with connections['default'].execute_wrapper(recorder):
+        response = getattr(client, scenario.method)(url, data, headers=headers)
+        if response.streaming:
+            b"".join(response.streaming_content)
+    return recorder.statements
+
+
+def find_sequential_scans(scenarios=SCENARIOS, username=None, allowed=SMALL_TABLES):
+    """
+    Return {scenario key: [(table, sql), ...]} for every statement of
+    ``scenarios`` that reads a table outside ``allowed`` without an index.
+    Writes made by the scenarios are rolled back.
+    """
+    connection = connections['default']
+    found = {}
+    settings_override = override_settings(
+        ALLOWED_HOSTS=["testserver"], QUERY_BUDGET_STRICT=False, QUERY_BUDGET_SAMPLE_RATE=0,
+    )
+    with settings_override, transaction.atomic():
+        fixtures = load_fixtures(username)
+        for scenario in scenarios:
+            seen = set()
+            for sql, params in scenario_statements(scenario, fixtures):
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                for table in sorted(sequential_scans(connection, sql, params) - set(allowed)):
+                    found.setdefault(scenario.key, []).append((table, sql))
+        transaction.set_rollback(True)
+    return found
@@ -0,0 +1,195 @@
+"""
+"Customers also bought" recommendations.
+
+Orders are mined into CoPurchase counts (how many orders contained both
+products). For each product the TOP_K strongest neighbours are written to
+RelatedProduct, topped up with products from the same category, so the
+product page reads its related products with one indexed lookup.
+
+refresh_recommendations() only reads orders and products added since the
+previous run and only rewrites the neighbours of products those orders
+touched, plus the new products.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import permutations
+
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .jobs import job
+from .models import CoPurchase, Order, OrderItem, Product, RecommendationState, RelatedProduct
+
+TOP_K = 8
+ORDER_BATCH_SIZE = 1000
+PRODUCT_BATCH_SIZE = 500
+# Very large baskets add little signal and a quadratic number of pairs
+MAX_PRODUCTS_PER_ORDER = 50
+# Orders younger than this are left for the next run, so an order whose
+# transaction commits late (with a lower id) is never skipped.
+SETTLE_DELAY = timedelta(minutes=5)
+
+
+def related_products_for(product, limit=TOP_K):
+    """Return up to ``limit`` related products, best first."""
+    entries = (
+        RelatedProduct.objects.filter(product=product)
+        .select_related('related')
+        .order_by('rank')[:limit]
+    )
+    related = [entry.related for entry in entries]
+    if related:
+        return related
+    # Not computed yet (e.g. a product added since the last refresh)
+    return list(
+        Product.objects.filter(category_id=product.category_id)
+        .exclude(id=product.id)
+        .order_by('-created_at')[:limit]
+    )
+
+
+# ====================== MINING ======================
+
+def _count_pairs(order_ids):
+    baskets = defaultdict(set)
+    items = (
+        OrderItem.objects.filter(order_id__in=order_ids, variant__isnull=False)
+        .values_list('order_id', 'variant__product_id')
+    )
+    for order_id, product_id in items:
+        baskets[order_id].add(product_id)
+
+    pairs = Counter()
+    for products in baskets.values():
+        products = sorted(products)[:MAX_PRODUCTS_PER_ORDER]
+        pairs.update(permutations(products, 2))
+    return pairs
+
+
+def _add_pair_counts(pairs):
+    """Add ``pairs`` to the stored CoPurchase counts. Returns touched product ids."""
+    product_ids = {product_id for product_id, _ in pairs}
+    existing = {}
+    for product_id, other_id, count in (
+        CoPurchase.objects.filter(product_id__in=product_ids)
+        .values_list('product_id', 'other_id', 'count')
+    ):
+        existing[(product_id, other_id)] = count
+
+    rows = [
+        CoPurchase(product_id=product_id, other_id=other_id,
+                   count=existing.get((product_id, other_id), 0) + count)
+        for (product_id, other_id), count in pairs.items()
+    ]
+    CoPurchase.objects.bulk_create(
+        rows, batch_size=1000,
+        update_conflicts=True, unique_fields=['product', 'other'], update_fields=['count'],
+    )
+    return product_ids
+
+
+# ====================== TOP-K ======================
+
+def _category_fallbacks(category_ids):
+    # The newest TOP_K + 1 products of each category; one is possibly the
+    # product itself, which leaves TOP_K to choose from.
+    fallbacks = defaultdict(list)
+    newest = (
+        Product.objects.filter(category_id__in=category_ids)
+        .annotate(position=Window(
+            RowNumber(), partition_by=F('category_id'),
+            order_by=[F('created_at').desc(), F('id').desc()],
+        ))
+        .filter(position__lte=TOP_K + 1)
+        .values_list('category_id', 'id')
+    )
+    for category_id, product_id in newest:
+        fallbacks[category_id].append(product_id)
+    return fallbacks
+
+
+def rebuild_related(product_ids):
+    """Recompute the RelatedProduct rows of the given products."""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), PRODUCT_BATCH_SIZE):
+        batch = product_ids[start:start + PRODUCT_BATCH_SIZE]
+
+        neighbours = defaultdict(list)
+        top = (
+            CoPurchase.objects.filter(product_id__in=batch)
+            .annotate(position=Window(
+                RowNumber(), partition_by=F('product_id'),
+                order_by=[F('count').desc(), F('other_id').asc()],
+            ))
+            .filter(position__lte=TOP_K)
+            .values_list('product_id', 'other_id', 'count')
+        )
+        for product_id, other_id, count in top:
+            neighbours[product_id].append((other_id, count, RelatedProduct.SOURCE_CO_PURCHASE))
+
+        categories = dict(Product.objects.filter(id__in=batch).values_list('id', 'category_id'))
+        fallbacks = _category_fallbacks(set(categories.values()))
+
+        rows = []
+        for product_id, category_id in categories.items():
+            chosen = neighbours[product_id]
+            seen = {other_id for other_id, _, _ in chosen} | {product_id}
+            for other_id in fallbacks[category_id]:
+                if len(chosen) >= TOP_K:
+                    break
+                if other_id not in seen:
+                    chosen.append((other_id, 0, RelatedProduct.SOURCE_CATEGORY))
+                    seen.add(other_id)
+            rows.extend(
+                RelatedProduct(product_id=product_id, related_id=other_id,
+                               rank=rank, score=score, source=source)
+                for rank, (other_id, score, source) in enumerate(chosen, start=1)
+            )
+
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=batch).delete()
+            RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+
+
+@job('refresh_recommendations')
+def refresh_recommendations(full=False):
+    """
+    Fold orders placed since the last run into the co-purchase counts and
+    rebuild the neighbours of every product they touched, plus every product
+    added since the last run. ``full`` starts over from the first order.
+    Returns (orders_read, products_rebuilt).
+    """
+    with transaction.atomic():
+        state, _ = RecommendationState.objects.select_for_update().get_or_create(pk=1)
+        if full:
+            CoPurchase.objects.all().delete()
+            state.last_order_id = 0
+
+        cutoff = timezone.now() - SETTLE_DELAY
+        order_ids = list(
+            Order.objects.filter(id__gt=state.last_order_id, created_at__lte=cutoff)
+            .exclude(status='Cancelled')
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        touched = set()
+        for start in range(0, len(order_ids), ORDER_BATCH_SIZE):
+            pairs = _count_pairs(order_ids[start:start + ORDER_BATCH_SIZE])
+            touched |= _add_pair_counts(pairs)
+
+        # New products are recorded by id, so one left without neighbours
+        # (nothing bought with it, alone in its category) is built once and
+        # not rescanned on every run.
+        new_products = Product.objects.all() if full else Product.objects.filter(id__gt=state.last_product_id)
+        new_product_ids = list(new_products.order_by('id').values_list('id', flat=True))
+        touched |= set(new_product_ids)
+        rebuild_related(touched)
+
+        if order_ids:
+            state.last_order_id = order_ids[-1]
+        if new_product_ids:
+            state.last_product_id = new_product_ids[-1]
+        state.save()
+    return len(order_ids), len(touched)
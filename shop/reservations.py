@@ -0,0 +1,162 @@
+"""
+Checkout stock reservations.
+
+Opening the checkout page holds the stock of every cart line for
+settings.STOCK_RESERVATION_TTL seconds (15 minutes by default), so it can't be sold to someone else while the
+customer is in the payment popup. A hold is a StockReservation row, and
+its quantity is also added to ProductVariant.reserved. Product pages read
+``variant.available`` (stock - reserved) from the variant row they already
+load, and never sum the reservations.
+
+Every change to the holds is a fixed number of statements whatever the size
+of the cart. ProductVariant.reserved is adjusted with one conditional UPDATE
+that refuses to hold more than the unreserved stock. place_order() turns
+the customer's holds into sold stock with the same UPDATE that takes the
+stock.
+
+Expired holds still count in ProductVariant.reserved until they are
+released, and their customer can still use them. A checkout that finds
+too little unreserved stock releases the expired holds of its variants
+and tries once more, so an abandoned checkout page never blocks a sale.
+``manage.py expire_reservations`` (a cron job in render.yaml, every
+minute) releases the rest in bulk, which keeps the availability shown on
+product pages honest.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ProductVariant, StockReservation
+
+DEFAULT_TTL = 15 * 60
+EXPIRE_BATCH_SIZE = 1000
+
+
+class _Unavailable(Exception):
+    pass
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_TTL))
+
+
+def _adjust(deltas):
+    # In a savepoint, so a partial adjustment is undone before the caller
+    # reads the stock levels back
+    deltas = {variant_id: delta for variant_id, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    try:
+        with transaction.atomic():
+            if ProductVariant.objects.adjust_reserved(deltas) < len(deltas):
+                raise _Unavailable
+    except _Unavailable:
+        return False
+    return True
+
+
+def hold_cart(user, lines):
+    """
+    Make ``user``'s holds match the cart ``lines`` and restart their clock.
+    Returns the variants whose unreserved stock can't cover their line; in
+    that case nothing changes.
+    """
+    quantities = {}
+    for line in lines:
+        quantities[line.variant_id] = quantities.get(line.variant_id, 0) + line.quantity
+
+    with transaction.atomic():
+        held = dict(
+            StockReservation.objects.select_for_update()
+            .filter(user=user).values_list('variant_id', 'quantity')
+        )
+        deltas = {
+            variant_id: quantities.get(variant_id, 0) - held.get(variant_id, 0)
+            for variant_id in quantities.keys() | held.keys()
+        }
+        if not _adjust(deltas) and not (
+            expire_reservations(variant_ids=deltas, exclude_user=user) and _adjust(deltas)
+        ):
+            variants = ProductVariant.objects.in_bulk(quantities)
+            return [
+                line.variant for line in lines
+                if variants[line.variant_id].available + held.get(line.variant_id, 0) < quantities[line.variant_id]
+            ]
+
+        dropped = held.keys() - quantities.keys()
+        if dropped:
+            StockReservation.objects.filter(user=user, variant_id__in=dropped).delete()
+        if quantities:
+            expires_at = timezone.now() + reservation_ttl()
+            StockReservation.objects.bulk_create(
+                [
+                    StockReservation(user=user, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+                    for variant_id, quantity in quantities.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['user', 'variant'],
+                update_fields=['quantity', 'expires_at'],
+            )
+    return []
+
+
+def take_holds(user):
+    """
+    Delete ``user``'s holds and return them as ``{variant_id: quantity}``. The
+    caller must release them from ProductVariant.reserved in the same
+    transaction, with decrement_stock(held=...) or release_holds().
+    """
+    held = dict(
+        StockReservation.objects.select_for_update()
+        .filter(user=user).values_list('variant_id', 'quantity')
+    )
+    if held:
+        StockReservation.objects.filter(user=user).delete()
+    return held
+
+
+def release_holds(held):
+    _adjust({variant_id: -quantity for variant_id, quantity in held.items()})
+
+
+def expire_reservations(now=None, batch_size=EXPIRE_BATCH_SIZE, variant_ids=None, exclude_user=None):
+    """
+    Release every hold that expired before ``now``, or only those on
+    ``variant_ids`` and not ``exclude_user``'s. Returns how many.
+    """
+    now = now or timezone.now()
+    expired_holds = StockReservation.objects.filter(expires_at__lte=now)
+    if variant_ids is not None:
+        expired_holds = expired_holds.filter(variant_id__in=list(variant_ids))
+    if exclude_user is not None:
+        expired_holds = expired_holds.exclude(user=exclude_user)
+    expired = 0
+    while True:
+        with transaction.atomic():
+            # Skip holds that a checkout is converting right now
+            batch = list(
+                expired_holds.select_for_update(skip_locked=True)
+                .values_list('id', 'variant_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                return expired
+            released = {}
+            for _, variant_id, quantity in batch:
+                released[variant_id] = released.get(variant_id, 0) + quantity
+            release_holds(released)
+            StockReservation.objects.filter(id__in=[row[0] for row in batch]).delete()
+        expired += len(batch)
+
+
+def rebuild_reserved():
+    """Recompute ProductVariant.reserved from the live holds, e.g. after deleting users."""
+    totals = (
+        StockReservation.objects.filter(variant=OuterRef('pk')).order_by()
+        .values('variant').annotate(total=Sum('quantity')).values('total')
+    )
+    # Plain QuerySet.update: the product summaries don't depend on reserved
+    return models.QuerySet.update(ProductVariant.objects.all(), reserved=Coalesce(Subquery(totals), Value(0)))
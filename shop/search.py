@@ -0,0 +1,166 @@
+"""
+Product search backed by the SearchToken inverted index.
+
+Every product is broken into lowercase word tokens taken from its name,
+category name, variant weights and description. Each (token, product) pair
+is stored once with a weight, so a query is a handful of indexed lookups on
+``SearchToken.token`` followed by a GROUP BY product - never a LIKE scan
+over the product table. SearchTerm holds the distinct tokens so that a
+prefix ("carda") can be expanded to whole tokens ("cardamom") first.
+"""
+import re
+from collections import defaultdict
+
+from django.core.paginator import Paginator
+from django.db.models import Count, Sum
+
+from .models import Product, SearchTerm, SearchToken
+
+# Ranking weight of a token depending on where it was found
+NAME_WEIGHT = 10
+CATEGORY_WEIGHT = 4
+VARIANT_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_TOKEN_LENGTH = 40
+MAX_QUERY_TERMS = 6
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_EXPANSIONS = 10
+RESULTS_PER_PAGE = 20
+MAX_RESULTS = 500
+COMMON_TERM_POSTINGS = 10000
+INDEX_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def product_tokens(product, variants):
+    """Return a {token: weight} dict for a product and its variants."""
+    weights = defaultdict(int)
+    for token in tokenize(product.name):
+        weights[token] += NAME_WEIGHT
+    for token in tokenize(product.category.name):
+        weights[token] += CATEGORY_WEIGHT
+    for variant in variants:
+        for token in tokenize(variant.weight):
+            weights[token] += VARIANT_WEIGHT
+    # Description words count once each so long descriptions can't outrank names
+    for token in set(tokenize(product.description)):
+        weights[token] += DESCRIPTION_WEIGHT
+    return weights
+
+
+# ====================== INDEXING ======================
+
+def index_products(product_ids):
+    """(Re)build the index rows for the given products."""
+    product_ids = list(set(product_ids))
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch = product_ids[start:start + INDEX_BATCH_SIZE]
+        products = (
+            Product.objects.filter(id__in=batch)
+            .select_related('category')
+            .prefetch_related('variants')
+        )
+        rows = []
+        for product in products:
+            for token, weight in product_tokens(product, product.variants.all()).items():
+                rows.append(SearchToken(token=token, product_id=product.id, weight=weight))
+
+        SearchToken.objects.filter(product_id__in=batch).delete()
+        SearchToken.objects.bulk_create(rows, batch_size=2000)
+        # The vocabulary only grows; a stale term simply expands to no postings
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(token=token) for token in {row.token for row in rows}],
+            batch_size=2000, ignore_conflicts=True,
+        )
+
+
+def rebuild_index():
+    """Reindex the whole catalog. Returns the number of products indexed."""
+    SearchToken.objects.all().delete()
+    SearchTerm.objects.all().delete()
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    index_products(product_ids)
+    return len(product_ids)
+
+
+# ====================== QUERYING ======================
+
+def _expand_terms(terms):
+    # All terms match whole tokens except the last one, which is matched as a
+    # prefix so results show up while the customer is still typing. Tokens only
+    # contain [a-z0-9], so every token starting with ``last`` sorts between
+    # ``last`` and ``last`` + "zzz...", which any btree index can range-scan.
+    groups = [[term] for term in terms[:-1]]
+    last = terms[-1]
+    if len(last) >= MIN_PREFIX_LENGTH:
+        groups.append(list(
+            SearchTerm.objects.filter(token__range=(last, last.ljust(MAX_TOKEN_LENGTH, 'z')))
+            .order_by('token')
+            .values_list('token', flat=True)[:MAX_PREFIX_EXPANSIONS]
+        ))
+    else:
+        groups.append([last])
+    return [tokens for tokens in groups if tokens]
+
+
+def _prune_common_terms(groups):
+    # A term that matches most of the catalog (e.g. "spices") adds a huge
+    # GROUP BY without changing the order much, so it is dropped whenever a
+    # more selective term is present. The count stops at the limit, so this
+    # never walks a full posting list.
+    sizes = [
+        SearchToken.objects.filter(token__in=tokens)[:COMMON_TERM_POSTINGS + 1].count()
+        for tokens in groups
+    ]
+    kept = [tokens for tokens, size in zip(groups, sizes) if size <= COMMON_TERM_POSTINGS]
+    return kept or [groups[sizes.index(min(sizes))]]
+
+
+def _page_products(page):
+    ids = [row['product_id'] for row in page.object_list]
+    products = Product.objects.filter(id__in=ids).select_related('category')
+    by_id = {product.id: product for product in products}
+    page.object_list = [by_id[product_id] for product_id in ids if product_id in by_id]
+    return page
+
+
+def search_products(query, page_number=1, per_page=RESULTS_PER_PAGE):
+    """
+    Return a Page of Products matching ``query``.
+
+    Products matching more of the query terms rank first, then by summed
+    token weight. Prices come from the denormalized ``Product.min_price``.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    groups = _expand_terms(terms) if terms else []
+    if not groups:
+        return Paginator(SearchToken.objects.none(), per_page).get_page(1)
+    if len(groups) > 1:
+        groups = _prune_common_terms(groups)
+
+    if len(groups) == 1 and len(groups[0]) == 1:
+        # A single token: (token, product) is unique, so its postings already
+        # are the ranking and can be read straight off the index in order.
+        matches = (
+            SearchToken.objects.filter(token=groups[0][0])
+            .values('product_id')
+            .order_by('-weight', 'product_id')
+        )
+        return _page_products(Paginator(matches, per_page).get_page(page_number))
+
+    # ``hits`` counts matching tokens rather than matching terms: a product
+    # with two expansions of the same prefix counts twice, which is rare and
+    # keeps the GROUP BY a plain COUNT instead of one CASE per term.
+    matches = (
+        SearchToken.objects.filter(token__in=[token for tokens in groups for token in tokens])
+        .values('product_id')
+        .annotate(hits=Count('*'), score=Sum('weight'))
+        .order_by('-hits', '-score', 'product_id')
+    )
+    # Only the best MAX_RESULTS are kept, which saves a second GROUP BY to count
+    return _page_products(Paginator(list(matches[:MAX_RESULTS]), per_page).get_page(page_number))
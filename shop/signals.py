@@ -1,7 +1,16 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import CustomerProfile
+from django.contrib.auth.signals import user_logged_in
+from .models import (
+    CustomerProfile, Category, Product, ProductVariant, ProductImage, HomePageFeatured, Order, OrderItem
+)
+from . import analytics
+from .search import index_products
+from .catalog_cache import bump_catalog_version
+from .cart import merge_session_cart
+from .images import queue_renditions
 
 @receiver(post_save, sender=User)
 def create_customer_profile(sender, instance, created, **kwargs):
@@ -12,3 +21,100 @@ def create_customer_profile(sender, instance, created, **kwargs):
 def save_customer_profile(sender, instance, **kwargs):
     if hasattr(instance, 'customerprofile'):
         instance.customerprofile.save()
+
+
+# ====================== CART ======================
+# A guest's session cart would otherwise be abandoned at login, because
+# customers' carts live in CartItem. Covers the login view, register and allauth.
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request.session, user)
+
+
+# ====================== SEARCH INDEX ======================
+# Reindexing waits for the transaction to commit so that the admin, which saves
+# a product and then its variant inlines, indexes the final state.
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_products([instance.pk]))
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+def reindex_variant_product(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: index_products([product_id]))
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if created:
+        return
+    category_id = instance.pk
+    transaction.on_commit(lambda: index_products(
+        Product.objects.filter(category_id=category_id).values_list('id', flat=True)
+    ))
+
+
+# ====================== PRICE SUMMARY ======================
+
+@receiver([post_save, post_delete], sender=ProductVariant)
+def refresh_product_price_summary(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).refresh_price_summary()
+
+
+# ====================== IMAGE RENDITIONS ======================
+# A new image queues its resizing for the job worker.
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def queue_image_renditions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        queue_renditions(instance)
+
+
+# ====================== CATALOG CACHE ======================
+# Any catalog write makes every cached catalog page stale at once.
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=HomePageFeatured)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+@receiver(m2m_changed, sender=HomePageFeatured.products.through)
+def invalidate_featured_products(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
+
+
+# ====================== SALES ROLLUPS ======================
+# Bulk writes bypass these: place_order() counts its bulk-created items
+# itself, anything else needs a rebuild (see shop/analytics.py).
+
+@receiver(pre_save, sender=Order)
+def remember_counted_order(sender, instance, raw=False, **kwargs):
+    instance._counted = analytics.counted_state(instance) if instance.pk and not raw else None
+
+@receiver(post_save, sender=Order)
+def move_order_counts(sender, instance, created, raw=False, **kwargs):
+    counted, instance._counted = getattr(instance, '_counted', None), None
+    if raw:
+        return
+    if created:
+        analytics.order_created(instance)
+    elif counted is not None:
+        analytics.order_changed(instance, counted)
+
+@receiver(post_save, sender=OrderItem)
+def count_order_item(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        analytics.record_items(instance.order, [instance])
+
+@receiver(pre_delete, sender=Order)
+def remove_order_counts(sender, instance, **kwargs):
+    # Before the cascade takes the items away
+    analytics.order_deleted(instance)
@@ -0,0 +1,240 @@
+"""
+Synthetic shop data for benchmarks.
+
+seed_shop() fills the database with a catalog and customer activity shaped
+like a real store rather than a uniform grid. A few categories and products
+draw most of the attention (Zipf), prices are log-normal, some variants are
+out of stock, repeat customers place most orders, and order history is
+spread over the past year. Every slug, username and order number carries
+``prefix`` so seeded data is easy to tell apart from real data.
+"""
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import rebuild_rollups
+from .catalog_cache import bump_catalog_version
+from .models import (
+    Address, CartItem, Category, CustomerProfile, Order, OrderItem,
+    Product, ProductImage, ProductVariant,
+)
+from .recommendations import refresh_recommendations
+from .search import index_products
+
+SPICES = [
+    "cardamom", "pepper", "cinnamon", "clove", "nutmeg", "mace", "turmeric",
+    "ginger", "cumin", "coriander", "fennel", "fenugreek", "mustard", "saffron",
+    "vanilla", "chilli", "paprika", "anise", "ajwain", "allspice", "bayleaf",
+    "curry", "garam", "masala", "tamarind", "kokum", "coffee", "tea", "honey",
+]
+ADJECTIVES = [
+    "green", "black", "white", "whole", "ground", "organic", "roasted",
+    "smoked", "wild", "premium", "coorg", "malabar", "forest", "estate",
+]
+WEIGHTS = ["50g", "100g", "250g", "500g", "1kg"]
+GRAMS = {"50g": 50, "100g": 100, "250g": 250, "500g": 500, "1kg": 1000}
+CITIES = [
+    ("Madikeri", "Karnataka"), ("Bengaluru", "Karnataka"), ("Mysuru", "Karnataka"),
+    ("Chennai", "Tamil Nadu"), ("Kochi", "Kerala"), ("Mumbai", "Maharashtra"),
+    ("Pune", "Maharashtra"), ("Hyderabad", "Telangana"), ("Delhi", "Delhi"),
+]
+ORDER_STATUSES = [("Delivered", 70), ("Shipped", 8), ("Processing", 4), ("Pending", 8), ("Cancelled", 10)]
+
+CENTS = Decimal("0.01")
+BATCH_SIZE = 2000
+DEFAULT_PASSWORD = "synthetic-pass-123"
+
+
+def zipf_weights(count, exponent=1.0):
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def zipf_vocabulary(size, rng):
+    # Made-up words with a Zipf-like frequency so common terms dominate, as in
+    # real product copy.
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+    return words, zipf_weights(size)
+
+
+# ====================== CATALOG ======================
+
+def seed_catalog(rng, products, categories=12, prefix="synthetic", vocabulary=None):
+    """Create categories, products, variants and images. Returns the products."""
+    words, word_weights = vocabulary or zipf_vocabulary(3000, rng)
+    names = [f"{adjective.title()} Spices" for adjective in ADJECTIVES]
+    names += [f"Spice Collection {n}" for n in range(len(names), categories)]
+    category_objs = Category.objects.bulk_create(
+        [Category(name=name) for name in names[:categories]]
+    )
+
+    product_objs = []
+    category_weights = zipf_weights(len(category_objs), exponent=0.8)
+    for i in range(products):
+        name = f"{rng.choice(ADJECTIVES).title()} {rng.choice(SPICES).title()} {i}"
+        description = " ".join(rng.choices(words, word_weights, k=rng.randint(20, 80)) + rng.sample(SPICES, 3))
+        product_objs.append(Product(
+            name=name, slug=f"{prefix}-{i}",
+            category=rng.choices(category_objs, category_weights)[0],
+            description=description, image=f"products/{prefix}.jpg",
+        ))
+    product_objs = Product.objects.bulk_create(product_objs, batch_size=BATCH_SIZE)
+
+    variants = []
+    images = []
+    for product in product_objs:
+        # Price per 100g around Rs. 250, heavier packs a little cheaper per gram
+        per_100g = rng.lognormvariate(math.log(250), 0.6)
+        count = rng.choices([1, 2, 3, 4], [15, 35, 35, 15])[0]
+        for weight in sorted(rng.sample(WEIGHTS, count), key=GRAMS.get):
+            grams = GRAMS[weight]
+            price = Decimal(per_100g * grams / 100 * (0.9 if grams >= 500 else 1)).quantize(CENTS)
+            variants.append(ProductVariant(
+                product=product, weight=weight, price=price,
+                old_price=(price * Decimal("1.2")).quantize(CENTS) if rng.random() < 0.3 else None,
+                stock=0 if rng.random() < 0.08 else int(rng.expovariate(1 / 40)) + 1,
+            ))
+        roles = [ProductImage.ROLE_MAIN] + [ProductImage.ROLE_SIDE_1, ProductImage.ROLE_SIDE_2,
+                                            ProductImage.ROLE_GALLERY][:rng.randint(0, 3)]
+        images.extend(
+            ProductImage(product=product, image=f"product_gallery/{prefix}-{role}.jpg", role=role)
+            for role in roles
+        )
+    # ProductVariant.objects.bulk_create also fills in the price summaries
+    ProductVariant.objects.bulk_create(variants, batch_size=BATCH_SIZE)
+    ProductImage.objects.bulk_create(images, batch_size=BATCH_SIZE)
+    return product_objs
+
+
+# ====================== CUSTOMERS ======================
+
+def seed_customers(rng, users, prefix="synthetic", password=DEFAULT_PASSWORD):
+    """Create users with profiles and one to three addresses. Returns the users."""
+    hashed = make_password(password)  # hashing is slow, so every user shares one hash
+    user_objs = User.objects.bulk_create([
+        User(username=f"{prefix}-user-{i}", email=f"{prefix}-user-{i}@example.com",
+             first_name=f"Customer{i}", password=hashed)
+        for i in range(users)
+    ], batch_size=BATCH_SIZE)
+
+    profiles = []
+    addresses = []
+    for user in user_objs:
+        city, state = rng.choice(CITIES)
+        profiles.append(CustomerProfile(user=user, phone=f"9{rng.randint(0, 10**9 - 1):09d}",
+                                        city=city, state=state))
+        for n in range(rng.choices([1, 2, 3], [60, 30, 10])[0]):
+            city, state = rng.choice(CITIES)
+            addresses.append(Address(
+                user=user, flat=f"{rng.randint(1, 400)}", area=f"{rng.choice(ADJECTIVES).title()} Layout",
+                landmark="Near temple", pincode=f"{rng.randint(110000, 699999)}",
+                city=city, state=state, contact=f"9{rng.randint(0, 10**9 - 1):09d}",
+                is_selected=n == 0,
+            ))
+    CustomerProfile.objects.bulk_create(profiles, batch_size=BATCH_SIZE)
+    Address.objects.bulk_create(addresses, batch_size=BATCH_SIZE)
+    return user_objs
+
+
+def seed_activity(rng, users, orders, prefix="synthetic", days=365):
+    """Create cart items and ``orders`` orders for the seeded users and products."""
+    variants = list(
+        ProductVariant.objects.filter(product__slug__startswith=f"{prefix}-")
+        .values_list("id", "product_id", "price")
+    )
+    # What OrderItem.snapshot_variant() would copy, per variant
+    snapshots = {
+        variant_id: {"product_name": name, "product_slug": slug, "weight": weight, "image": image}
+        for variant_id, name, slug, weight, image in
+        ProductVariant.objects.filter(product__slug__startswith=f"{prefix}-")
+        .values_list("id", "product__name", "product__slug", "weight", "product__image")
+    }
+    by_product = {}
+    for variant in variants:
+        by_product.setdefault(variant[1], []).append(variant)
+    # A shuffled Zipf over products: a few best sellers, a long tail
+    popular = list(by_product)
+    rng.shuffle(popular)
+    popularity = zipf_weights(len(popular))
+    addresses = dict(
+        Address.objects.filter(user__username__startswith=f"{prefix}-user-", is_selected=True)
+        .values_list("user_id", "id")
+    )
+
+    def pick_variants(count):
+        return [rng.choice(by_product[product_id]) for product_id in set(rng.choices(popular, popularity, k=count))]
+
+    cart_items = [
+        CartItem(user=user, variant_id=variant_id, quantity=rng.randint(1, 3))
+        for user in users if rng.random() < 0.3
+        for variant_id, _, _ in pick_variants(rng.randint(1, 5))
+    ]
+    CartItem.objects.bulk_create(cart_items, batch_size=BATCH_SIZE)
+
+    now = timezone.now()
+    statuses, status_weights = zip(*ORDER_STATUSES)
+    customer_weights = zipf_weights(len(users), exponent=0.7)
+    # Seeded order numbers are the prefix's initial plus a counter, which never
+    # clashes with the all-digit numbers of real orders.
+    letter = prefix[:1].upper()
+    first_number = Order.objects.filter(order_number__startswith=letter).count()
+    order_objs = []
+    basket_items = []
+    for n in range(first_number, first_number + orders):
+        user = rng.choices(users, customer_weights)[0]
+        basket = [(variant_id, price, rng.choices([1, 2, 3], [75, 20, 5])[0])
+                  for variant_id, _, price in pick_variants(rng.choices([1, 2, 3, 4, 6], [35, 30, 20, 10, 5])[0])]
+        status = rng.choices(statuses, status_weights)[0]
+        order_objs.append(Order(
+            user=user, address_id=addresses.get(user.id),
+            total_price=sum(price * quantity for _, price, quantity in basket),
+            status=status,
+            payment_status="Failed" if status == "Cancelled" else "Success",
+            order_number=f"{letter}{n:07d}",
+        ))
+        basket_items.append(basket)
+    order_objs = Order.objects.bulk_create(order_objs, batch_size=BATCH_SIZE)
+
+    # created_at is auto_now_add, so history is backdated after the insert
+    for order in order_objs:
+        order.created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+    Order.objects.bulk_update(order_objs, ["created_at"], batch_size=BATCH_SIZE)
+
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, variant_id=variant_id, quantity=quantity, price=price, **snapshots[variant_id])
+        for order, basket in zip(order_objs, basket_items)
+        for variant_id, price, quantity in basket
+    ], batch_size=BATCH_SIZE)
+    return len(cart_items), len(order_objs)
+
+
+def seed_shop(products=1000, categories=12, users=200, orders=2000, prefix="synthetic",
+              seed=42, password=DEFAULT_PASSWORD):
+    """
+    Seed a complete shop. Everything the signals would maintain is brought up
+    to date at the end: the search index, the recommendations, the sales
+    rollups and the catalog cache version. Returns counts.
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        product_objs = seed_catalog(rng, products, categories=categories, prefix=prefix)
+        user_objs = seed_customers(rng, users, prefix=prefix, password=password)
+        cart_items, order_count = seed_activity(rng, user_objs, orders, prefix=prefix)
+        # bulk_create skips the signals that maintain the derived tables
+        index_products([product.id for product in product_objs])
+        refresh_recommendations()
+        rebuild_rollups()
+        bump_catalog_version()
+    return {
+        "categories": categories,
+        "products": len(product_objs),
+        "users": len(user_objs),
+        "cart_items": cart_items,
+        "orders": order_count,
+    }
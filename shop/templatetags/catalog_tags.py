@@ -0,0 +1,41 @@
+from django import template
+
+from shop.catalog_cache import cached_catalog
+
+register = template.Library()
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        parts = [variable.resolve(context) for variable in self.vary_on]
+        return cached_catalog(
+            self.name.resolve(context),
+            lambda: self.nodelist.render(context),
+            *parts
+        )
+
+
+@register.tag
+def catalogcache(parser, token):
+    """
+    Cache a rendered fragment until the catalog changes.
+
+        {% catalogcache "category_detail_grid" category.id %} ... {% endcatalogcache %}
+
+    Only wrap markup that is the same for every visitor.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name.")
+    nodelist = parser.parse(('endcatalogcache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
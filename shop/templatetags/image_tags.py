@@ -1,13 +1,61 @@
 from django import template
+from django.utils.html import format_html
+
+from shop.models import ProductImage
 
 register = template.Library()
 
+@register.filter
+def image_url(product, role):
+    """URL of the product image with the given role, from Product.image_map."""
+    return product.image_map.get(role, '')
+
+def _role_url(images, role):
+    # Iterating (instead of .filter()) reuses prefetched images
+    for image in images:
+        if image.role == role:
+            return image.image.url
+    return ''
+
 @register.filter
 def get_main_image(images):
-    main = images.filter(alt_text='Main_Image').first()
-    return main.image.url if main else ''
+    return _role_url(images, 'main')
 
 @register.filter
 def get_side_image(images, label):
-    side = images.filter(alt_text=label).first()
-    return side.image.url if side else ''
+    return _role_url(images, ProductImage.LEGACY_ROLES.get(label, label))
+
+@register.simple_tag
+def responsive_image(instance, sizes='100vw', alt='', css_class='', fallback=''):
+    """
+    <img> of ``instance.image`` with WebP and JPEG srcsets built from its
+    renditions (shop/images.py), lazily loaded:
+
+        {% responsive_image product sizes="(max-width: 600px) 50vw, 280px" alt=product.name %}
+
+    Until the renditions exist it shows the original, and ``fallback`` when
+    there is no image at all.
+    """
+    image = instance.image
+    if not image:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', fallback, alt, css_class)
+
+    record = instance.image_renditions or {}
+    renditions = record.get('renditions') if record.get('source') == image.name else None
+    if not renditions:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', image.url, alt, css_class)
+
+    urls = {}
+    for rendition in renditions:
+        urls.setdefault(rendition['format'], []).append((image.storage.url(rendition['name']), rendition['width']))
+    srcsets = {fmt: ", ".join(f"{url} {width}w" for url, width in entries) for fmt, entries in urls.items()}
+    largest_jpeg = max(urls['jpeg'], key=lambda entry: entry[1])[0]
+    # display: contents keeps the <picture> out of the layout, so CSS written
+    # for a bare <img> (percentage sizes, object-fit) still applies
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcsets['webp'], sizes, largest_jpeg, srcsets['jpeg'], sizes, alt, css_class,
+    )
@@ -15,13 +15,16 @@ urlpatterns = [
     path('cart/', views.cart_view, name='cart'),
     path('remove-from-cart/', views.remove_from_cart, name='remove_from_cart'),
     path('update-cart-quantity/', views.update_cart_quantity, name='update_cart_quantity'),
+    path('search/', views.search, name='search'),
     path('categories/', views.category_list, name='category_list'),
     path('categories/<int:category_id>/', views.category_detail, name='category_detail'),
+    path('categories/<int:category_id>/products.json', views.category_products_json, name='category_products_json'),
     path('checkout/', views.final_checkout, name='checkout'),
     path('validate-address/<int:id>/', views.validate_address, name='validate-address'),
     path('add-address-checkout/', views.add_address_checkout, name='add_address_checkout'),
     path('confirmation/', views.order_confirmation, name='order_confirmation'),
     path("my-orders/", views.my_orders, name="my_orders"),
+    path("my-orders.json", views.my_orders_json, name="my_orders_json"),
     path("order-details/<int:order_id>/", views.order_details, name="order_details"),
 ]
 
@@ -40,10 +43,21 @@ urlpatterns += [
     path("address/delete/<int:address_id>/", delete_address, name="delete_address"),
 ]
 
+from . import api
+
+urlpatterns += [
+    path("api/v1/categories/", api.categories, name="api_categories"),
+    path("api/v1/categories/<int:category_id>/products/", api.category_products, name="api_category_products"),
+    path("api/v1/products/<slug:slug>/", api.product, name="api_product"),
+]
+
 from django.contrib.auth import views as auth_views
+from .emails import QueuedPasswordResetForm
 
 urlpatterns += [
-    path('password_reset/', auth_views.PasswordResetView.as_view(template_name='shop/password_reset.html'), name='password_reset'),
+    path('password_reset/', auth_views.PasswordResetView.as_view(
+        template_name='shop/password_reset.html', form_class=QueuedPasswordResetForm,
+    ), name='password_reset'),
     path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(template_name='shop/password_reset_done.html'), name='password_reset_done'),
     path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(template_name='shop/password_reset_confirm.html'), name='password_reset_confirm'),
     path('reset/done/', auth_views.PasswordResetCompleteView.as_view(template_name='shop/password_reset_complete.html'), name='password_reset_complete'),
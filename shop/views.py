@@ -4,41 +4,46 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.views import LoginView
 from django.contrib import messages
-from django.db.models import Min
 from .models import Product, CustomerProfile, Address, HomePageFeatured
+from .catalog_cache import cached_catalog
+from .pagination import keyset_page, normalize_cursor
 
 
 # ====================== BASIC VIEWS ======================
 
 def home(request):
-    # Fetch only one "Featured" entry (you can extend later if you want multiple sections)
-    featured = HomePageFeatured.objects.first()
+    def build():
+        # Fetch only one "Featured" entry (you can extend later if you want multiple sections)
+        featured = HomePageFeatured.objects.first()
 
-    products = []
-    if featured:
-        products = featured.products.all()[:featured.max_items]
+        products = []
+        if featured:
+            products = list(featured.products.all()[:featured.max_items])
 
-    return render(request, 'shop/index.html', {
-        'products': products,
-        'featured_title': featured.title if featured else "Featured Products"
-    })
+        return {
+            'products': products,
+            'featured_title': featured.title if featured else "Featured Products"
+        }
+
+    return render(request, 'shop/index.html', cached_catalog('home', build))
 
 
 
 from .models import Product, ProductVariant  # make sure ProductVariant is imported
+from .recommendations import related_products_for
 
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
+    # All gallery images in one query; product.image_map is built from them
+    product = get_object_or_404(Product.objects.prefetch_related('images'), slug=slug)
 
     # Fetch all variants of the product
-    variants = product.variants.all().order_by('price')  # lowest price first
+    variants = list(product.variants.all().order_by('price', 'id'))  # lowest price first
 
     # Pick the cheapest variant as default
-    default_variant = variants.first() if variants else None
+    default_variant = variants[0] if variants else None
 
-    # Related products
-    related_products = Product.objects.exclude(id=product.id).annotate(
-    lowest_price=Min('variants__price'))[:8]
+    # Related products, precomputed by refresh_recommendations
+    related_products = related_products_for(product)
 
     return render(request, 'shop/product_detail.html', {
         'product': product,
@@ -171,7 +176,7 @@ def save_address(request, address_id):
         selected = request.POST.get("selected")
         if selected and int(selected) == address.id:
             # Mark all others unselected
-            Address.objects.filter(user=request.user).update(is_selected=False)
+            Address.objects.filter(user=request.user, is_selected=True).update(is_selected=False)
             address.is_selected = True
 
         address.save()
@@ -203,43 +208,39 @@ def add_address(request):
 
 
 from .models import Product, ProductVariant
+from .cart import (
+    add_to_customer_cart, add_to_session_cart, remove_from_customer_cart,
+    remove_from_session_cart, session_cart_items, set_customer_cart_quantity,
+    set_session_cart_quantity,
+)
 from django.urls import reverse
 
+
+def _posted_variant(request):
+    # The cart forms identify a variant by product slug and weight
+    return ProductVariant.objects.select_related('product').get(
+        product__slug=request.POST.get('product_slug'),
+        weight=request.POST.get('variant_weight'),
+    )
+
 def add_to_cart(request):
     if request.method == 'POST':
-        product_slug = request.POST.get('product_slug')
-        variant_weight = request.POST.get('variant_weight')
         quantity = int(request.POST.get('quantity', 1))
 
         try:
-            product = Product.objects.get(slug=product_slug)
-            variant = product.variants.get(weight=variant_weight)
+            variant = _posted_variant(request)
 
             if request.user.is_authenticated:
                 # ✅ Save to DB
-                cart_item, created = CartItem.objects.get_or_create(
-                    user=request.user,
-                    variant=variant,
-                    defaults={'quantity': quantity}
-                )
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
+                add_to_customer_cart(request.user.id, variant.id, quantity)
             else:
                 # ✅ Save to session (for guest users)
-                cart = request.session.get('cart', {})
-                if product_slug in cart and variant_weight in cart[product_slug]:
-                    cart[product_slug][variant_weight]['quantity'] += quantity
-                else:
-                    cart.setdefault(product_slug, {})[variant_weight] = {
-                        'quantity': quantity
-                    }
-                request.session['cart'] = cart
+                add_to_session_cart(request.session, variant.id, quantity)
 
             messages.success(request, "Added to cart!")  
-            return redirect(reverse('product_detail', args=[product.slug]))
+            return redirect(reverse('product_detail', args=[variant.product.slug]))
 
-        except (Product.DoesNotExist, ProductVariant.DoesNotExist):
+        except ProductVariant.DoesNotExist:
             return redirect('home')
 
     return redirect('home')
@@ -262,25 +263,9 @@ def cart_view(request):
             })
             grand_total += total_price
     else:
-        # ✅ Load from session
-        session_cart = request.session.get('cart', {})
-        for product_slug, variants in session_cart.items():
-            try:
-                product = Product.objects.get(slug=product_slug)
-                for weight, info in variants.items():
-                    variant = product.variants.get(weight=weight)
-                    quantity = info['quantity']
-                    total_price = variant.price * quantity
-
-                    cart_items.append({
-                        'product': product,
-                        'variant': variant,
-                        'quantity': quantity,
-                        'total_price': total_price
-                    })
-                    grand_total += total_price
-            except Product.DoesNotExist:
-                continue
+        # ✅ Load from session, one query for the whole cart
+        cart_items = session_cart_items(request.session)
+        grand_total = sum(item['total_price'] for item in cart_items)
 
     return render(request, 'shop/cart.html', {
         'cart_items': cart_items,
@@ -294,23 +279,15 @@ from .models import CartItem, Product, ProductVariant
 
 @require_POST
 def remove_from_cart(request):
-    product_slug = request.POST.get('product_slug')
-    variant_weight = request.POST.get('variant_weight')
-
     try:
-        product = Product.objects.get(slug=product_slug)
-        variant = ProductVariant.objects.get(product=product, weight=variant_weight)
+        variant = _posted_variant(request)
 
         if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(user=request.user, variant=variant)
-            cart_item.delete()
+            remove_from_customer_cart(request.user.id, variant.id)
         else:
-            cart = request.session.get('cart', {})
-            if variant.slug in cart:
-                del cart[variant.slug]
-                request.session['cart'] = cart
+            remove_from_session_cart(request.session, variant.id)
 
-    except (Product.DoesNotExist, ProductVariant.DoesNotExist, CartItem.DoesNotExist):
+    except ProductVariant.DoesNotExist:
         pass
 
     return redirect('cart')
@@ -319,74 +296,89 @@ from django.http import JsonResponse
 
 @require_POST
 def update_cart_quantity(request):
-    product_slug = request.POST.get('product_slug')
-    variant_weight = request.POST.get('variant_weight')
     quantity = int(request.POST.get('quantity', 1))
 
     try:
-        product = Product.objects.get(slug=product_slug)
-        variant = product.variants.get(weight=variant_weight)
+        variant = _posted_variant(request)
 
         if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(user=request.user, variant=variant)
-            cart_item.quantity = quantity
-            cart_item.save()
+            if not set_customer_cart_quantity(request.user.id, variant.id, quantity):
+                return JsonResponse({'success': False, 'error': 'Item not found'})
         else:
-            cart = request.session.get('cart', {})
-            if product_slug in cart and variant_weight in cart[product_slug]:
-                cart[product_slug][variant_weight]['quantity'] = quantity
-                request.session['cart'] = cart
+            set_session_cart_quantity(request.session, variant.id, quantity)
 
         return JsonResponse({'success': True})
 
-    except (Product.DoesNotExist, ProductVariant.DoesNotExist, CartItem.DoesNotExist):
+    except ProductVariant.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Item not found'})
 
 
 from .models import Category  # add at the top if not already
 
 def category_list(request):
-    categories = Category.objects.all()
+    categories = cached_catalog('category_list', lambda: list(Category.objects.all()))
     return render(request, 'shop/category_list.html', {'categories': categories})
 
-def category_detail(request, category_id):
-    category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category).annotate(
-        lowest_price=Min('variants__price')
-    )
-    return render(request, 'shop/category_detail.html', {
-        'category': category,
-        'products': products,
-    })
+CATEGORY_PAGE_SIZE = 24
 
+def _category_page(category_id, cursor):
+    cursor = normalize_cursor(cursor)
 
-from .models import Product
+    def build():
+        category = get_object_or_404(Category, id=category_id)
+        # Price and default weight come from the denormalized cheapest variant,
+        # so a page of the grid is a single query.
+        products, next_cursor = keyset_page(
+            Product.objects.filter(category=category).select_related('cheapest_variant'),
+            cursor, CATEGORY_PAGE_SIZE
+        )
+        return {'category': category, 'products': products, 'cursor': cursor, 'next_cursor': next_cursor}
 
-def category_detail(request, category_id):
-    category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category).prefetch_related('variants')
+    return cached_catalog('category_detail', build, category_id, cursor)
 
-    # Attach cheapest variant to each product
-    for product in products:
-        cheapest_variant = product.variants.order_by('price').first()
-        product.cheapest_variant = cheapest_variant  # dynamically attach it
+def category_detail(request, category_id):
+    page = _category_page(category_id, request.GET.get('cursor'))
+    return render(request, 'shop/category_detail.html', page)
+
+def category_products_json(request, category_id):
+    # Infinite-scroll variant of category_detail
+    page = _category_page(category_id, request.GET.get('cursor'))
+    results = []
+    for product in page['products']:
+        variant = product.cheapest_variant
+        results.append({
+            'id': product.id,
+            'name': product.name,
+            'slug': product.slug,
+            'url': reverse('product_detail', args=[product.slug]),
+            'image': product.image.url if product.image else '',
+            'price': str(variant.price) if variant else None,
+            'weight': variant.weight if variant else None,
+            'in_stock': product.in_stock,
+        })
+    return JsonResponse({'results': results, 'next_cursor': page['next_cursor']})
 
-    return render(request, 'shop/category_detail.html', {
-        'category': category,
-        'products': products
-    })
+from .orders import delivery_fee as order_delivery_fee
+from .reservations import hold_cart
 
 @login_required
 def final_checkout(request):
     user = request.user
-    cart_items = CartItem.objects.filter(user=user).select_related('variant__product')
+    cart_items = list(CartItem.objects.filter(user=user).select_related('variant__product'))
     addresses = Address.objects.filter(user=user)
 
+    # Hold the stock while the customer is in the payment popup
+    short = hold_cart(user, cart_items)
+    if short:
+        names = ", ".join(str(variant) for variant in short)
+        messages.error(request, f"Not enough stock for {names}. Please update your cart.")
+        return redirect('cart')
+
     subtotal = 0
     for item in cart_items:
         subtotal += item.variant.price * item.quantity
 
-    delivery_fee = 50 if subtotal < 500 else 0  # example rule
+    delivery_fee = order_delivery_fee(subtotal)
     total = subtotal + delivery_fee
 
     return render(request, 'shop/checkout.html', {
@@ -414,7 +406,7 @@ def add_address_checkout(request):
 
         if use_for_order:
             # Unselect all other addresses
-            Address.objects.filter(user=user).update(is_selected=False)
+            Address.objects.filter(user=user, is_selected=True).update(is_selected=False)
 
         Address.objects.create(
             user=user,
@@ -437,6 +429,7 @@ def validate_address(request, id):
     return JsonResponse({'exists': exists})
 
 from .models import Order, OrderItem, CartItem, Address
+from .orders import EmptyCart, OutOfStock, place_order
 from django.views.decorators.csrf import csrf_exempt
 
 
@@ -453,38 +446,15 @@ def order_confirmation(request):
         except Address.DoesNotExist:
             return redirect("checkout")
 
-        # ✅ Collect cart
-        cart_items = CartItem.objects.filter(user=request.user).select_related('variant__product')
-
-        if not cart_items.exists():
+        # ✅ Place the order: stock, items and cart in one transaction
+        try:
+            order = place_order(request.user, address, paid=payment_status == "success")
+        except EmptyCart:
             messages.error(request, "Your cart is empty.")
             return redirect("cart")
-
-        # ✅ Calculate totals
-        subtotal = sum([item.variant.price * item.quantity for item in cart_items])
-        delivery_fee = 50 if subtotal < 500 else 0
-        total = subtotal + delivery_fee
-
-        # ✅ Create Order
-        order = Order.objects.create(
-            user=request.user,
-            address=address,
-            total_price=total,
-            payment_status="Completed" if payment_status == "success" else "Failed",
-            status="Pending" if payment_status == "success" else "Cancelled"
-        )
-
-        # ✅ Add OrderItems
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                variant=item.variant,
-                quantity=item.quantity,
-                price=item.variant.price
-            )
-
-        # ✅ Clear cart
-        cart_items.delete()
+        except OutOfStock as exc:
+            messages.error(request, f"{exc}. Please update your cart.")
+            return redirect("cart")
 
         return render(request, "shop/confirmation.html", {
             "order": order,
@@ -494,12 +464,50 @@ def order_confirmation(request):
     return redirect("checkout")
 
 
+ORDERS_PAGE_SIZE = 10
+
 @login_required
 def my_orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, "shop/my_orders.html", {"orders": orders})
+    orders, next_cursor = keyset_page(
+        Order.objects.filter(user=request.user).with_items(),
+        request.GET.get('cursor'), ORDERS_PAGE_SIZE
+    )
+    return render(request, "shop/my_orders.html", {"orders": orders, "next_cursor": next_cursor})
+
+@login_required
+def my_orders_json(request):
+    # Infinite-scroll variant of my_orders
+    orders, next_cursor = keyset_page(
+        Order.objects.filter(user=request.user), request.GET.get('cursor'), ORDERS_PAGE_SIZE
+    )
+    return JsonResponse({
+        'results': [{
+            'id': order.id,
+            'order_number': order.order_number,
+            'status': order.status,
+            'payment_status': order.payment_status,
+            'total_price': str(order.total_price),
+            'created_at': order.created_at.isoformat(),
+            'url': reverse('order_details', args=[order.id]),
+        } for order in orders],
+        'next_cursor': next_cursor,
+    })
 
 @login_required
 def order_details(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.with_items(), id=order_id, user=request.user)
     return render(request, "shop/order_details.html", {"order": order})
+
+
+# ====================== SEARCH ======================
+
+from .search import search_products
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = search_products(query, request.GET.get('page'))
+    return render(request, 'shop/search_results.html', {
+        'query': query,
+        'page_obj': page_obj,
+        'products': page_obj.object_list,
+    })